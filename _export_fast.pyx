@@ -0,0 +1,54 @@
+# cython: language_level=3
+"""
+Скомпилированные версии вспомогательных функций экспорта.
+Сборка: python setup.py build_ext --inplace
+"""
+
+from xml.etree.ElementTree import SubElement
+
+
+cpdef dict flatten_dict(dict d, str parent_key='', str sep='_'):
+    """Преобразует вложенный словарь в плоский."""
+    cdef dict flat = {}
+    cdef list stack = [(parent_key, iter(d.items()))]
+    # Ключи и префиксы не обязательно строки (индексы списков, числовые ключи)
+    cdef object prefix, items, k, v, new_key
+    cdef bint descended
+
+    while stack:
+        prefix, items = stack[-1]
+        descended = False
+        for k, v in items:
+            new_key = f"{prefix}{sep}{k}" if prefix else k
+            if type(v) is dict:
+                stack.append((new_key, iter((<dict>v).items())))
+                descended = True
+                break
+            if type(v) is list and v and type((<list>v)[0]) is dict:
+                # Для списков словарей создаем отдельные колонки
+                stack.append((new_key, enumerate(v)))
+                descended = True
+                break
+            flat[new_key] = v
+        if not descended:
+            stack.pop()
+    return flat
+
+
+cpdef void dict_to_xml(object parent, dict data) except *:
+    """Преобразует словарь в XML элементы."""
+    cdef object key, value, item, child
+    for key, value in data.items():
+        if isinstance(value, dict):
+            child = SubElement(parent, key)
+            dict_to_xml(child, value)
+        elif isinstance(value, list):
+            for item in value:
+                child = SubElement(parent, key)
+                if isinstance(item, dict):
+                    dict_to_xml(child, item)
+                else:
+                    child.text = str(item)
+        else:
+            child = SubElement(parent, key)
+            child.text = str(value) if value is not None else ""
@@ -1,15 +1,124 @@
+import asyncio
+import atexit
+import threading
+import time
+from pathlib import Path
 import telebot
+from telebot.async_telebot import AsyncTeleBot
 from auth_info import bot_token
 
 bot = telebot.TeleBot(bot_token)
-bot_name = f"@{bot.get_me().username}"
+# One async bot for all sends; its HTTP session lives on the background loop and is reused
+async_bot = AsyncTeleBot(bot_token)
 
+# The bot username is resolved lazily and cached on disk, keyed by bot ID
+BOT_NAME_CACHE_DIR = Path.home() / ".cache" / "tg_monitor"
 
-def sent_msg2bot(txt, user_id):
-    """Sends the given text message to the specified user ID via the bot."""
+_bot_name = None
+
+# Telegram allows a bot to send about 30 messages per second
+MAX_MESSAGES_PER_SECOND = 30
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average and at most `burst` at once,
+    in the order they were requested."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # The lock is held while waiting, so callers get tokens first come, first served
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Shared by every send in the process; all sends run on the single background loop
+_rate_limiter = TokenBucket(MAX_MESSAGES_PER_SECOND)
+
+
+def get_bot_name():
+    """Returns the bot's @username, calling get_me() only if it is not cached yet."""
+    global _bot_name
+    if _bot_name is not None:
+        return _bot_name
+
+    cache_file = BOT_NAME_CACHE_DIR / f"botname_{bot_token.split(':', 1)[0]}"
     try:
-        # Directly send the message, no need for handlers here
-        bot.send_message(user_id, txt)
-        # print(f"Sent to {user_id}: {txt}") # Optional: for debugging
-    except Exception as e:
-        print(f"Error sending message via bot to {user_id}: {e}")
+        _bot_name = cache_file.read_text(encoding="utf-8").strip() or None
+    except OSError:
+        pass
+
+    if _bot_name is None:
+        _bot_name = f"@{bot.get_me().username}"
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            cache_file.write_text(_bot_name, encoding="utf-8")
+        except OSError as e:
+            print(f"Could not cache bot name to {cache_file}: {e}")
+
+    return _bot_name
+
+
+async def send_batch(items):
+    """Sends (text, user_id) pairs concurrently, staying within the bot rate limit.
+
+    Must run on the background loop (see sent_msg2bot), which the rate limiter and
+    the bot session belong to.
+    """
+    async def send_one(txt, user_id):
+        await _rate_limiter.acquire()
+        await async_bot.send_message(user_id, txt)
+
+    results = await asyncio.gather(
+        *[send_one(txt, user_id) for txt, user_id in items],
+        return_exceptions=True,
+    )
+
+    for (txt, user_id), result in zip(items, results):
+        if isinstance(result, Exception):
+            print(f"Error sending message via bot to {user_id}: {result}")
+
+
+def _get_loop():
+    """Returns the background event loop used for sending, starting it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+    return _loop
+
+
+@atexit.register
+def _close_session():
+    """Closes the bot's HTTP session on the background loop at exit."""
+    if _loop is not None and _loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(async_bot.close_session(), _loop).result(timeout=5)
+        except Exception:
+            pass
+
+
+def sent_msg2bot(txt, user_id):
+    """Sends the given text message to the specified user ID via the bot.
+
+    The send is scheduled on the background loop so the caller is not blocked by the
+    HTTP round-trip. Returns a concurrent.futures.Future; wait for it (or await
+    asyncio.wrap_future(...)) when the message must arrive before something else.
+    """
+    return asyncio.run_coroutine_threadsafe(send_batch([(txt, user_id)]), _get_loop())
@@ -4,12 +4,95 @@
 """
 
 import re
-from typing import Dict, Any, List, Optional, Callable
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Callable, Tuple, Pattern, FrozenSet
 from datetime import datetime
 
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# Регулярные выражения компилируются один раз при импорте модуля
+URL_RE = re.compile(r'https?://\S+|www\.\S+')
+MENTION_RE = re.compile(r'@\w+')
+
+if re2 is not None:
+    _RE2_OPTIONS = re2.Options()
+    _RE2_OPTIONS.case_sensitive = False
+
+# Экранированный символ паттерна (пара "\\x"; "\\\\" - экранированная косая черта)
+_ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+# Классы, которые в RE2 совпадают только с ASCII, а в re - с любыми буквами Unicode
+_ASCII_ONLY_IN_RE2 = frozenset('wWbBdDsS')
+
+def _re2_compatible(pattern: str) -> bool:
+    """Проверяет, что паттерн совпадает в RE2 так же, как в re (нет \\w, \\b, \\d, \\s и т.п.)."""
+    return not any(char in _ASCII_ONLY_IN_RE2 for char in _ESCAPE_RE.findall(pattern))
+
+def _compile_pattern(pattern: str) -> Pattern:
+    """Компилирует паттерн через RE2 (линейное время), при неудаче - через re."""
+    if re2 is not None and _re2_compatible(pattern):
+        try:
+            return re2.compile(pattern, options=_RE2_OPTIONS)
+        except re2.error:
+            # Обратные ссылки и lookaround не поддерживаются RE2
+            pass
+    return re.compile(pattern, re.IGNORECASE)
+
+@lru_cache(maxsize=256)
+def _compile_patterns(patterns: Tuple[str, ...]) -> Tuple[Pattern, ...]:
+    """Компилирует пользовательские паттерны (с кэшированием по набору строк).
+    
+    Паттерны без групп объединяются в одну альтернативу, чтобы текст
+    просматривался один раз. При объединении группы перенумеровываются и
+    обратные ссылки (\\1) указывали бы не туда, поэтому паттерны с группами,
+    как и не компилирующееся объединение, проверяются по отдельности.
+    """
+    compiled = tuple(_compile_pattern(pattern) for pattern in patterns)
+    if len(compiled) > 1 and not any(pattern.groups for pattern in compiled):
+        try:
+            return (_compile_pattern('(?:' + ')|(?:'.join(patterns) + ')'),)
+        except re.error:
+            pass
+    return compiled
+
+@lru_cache(maxsize=4096)
+def _parse_iso_date(value: str) -> datetime:
+    """Разбирает дату в формате ISO (повторяющиеся строки берутся из кэша)."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def _to_datetime(value: Any) -> datetime:
+    """Приводит дату (строку ISO или datetime) к datetime."""
+    if isinstance(value, datetime):
+        return value
+    return _parse_iso_date(value)
+
 class ContentFilter:
     """Фильтрация сообщений по различным критериям."""
     
+    # Соответствие типа контента полю сообщения
+    MEDIA_KEYS = {
+        'text': 'message',
+        'photo': 'photo',
+        'video': 'video',
+        'audio': 'audio',
+        'document': 'document',
+        'sticker': 'sticker',
+        'voice': 'voice',
+        'video_note': 'video_note',
+        'contact': 'contact',
+        'location': 'geo',
+        'poll': 'poll',
+        'game': 'game'
+    }
+    
+    # Фильтры, которым достаточно атрибутов исходного сообщения Telethon
+    PREFILTERS = frozenset({
+        'text_patterns', 'date_range', 'min_length', 'has_links',
+        'has_mentions', 'is_forwarded', 'is_edited'
+    })
+    
     def __init__(self, config: Dict[str, Any] = None):
         self.config = config or {}
         self.filters = {
@@ -29,22 +112,11 @@ class ContentFilter:
         if not allowed_types:
             return True
         
-        media_types = {
-            'text': bool(message.get('message')),
-            'photo': bool(message.get('photo')),
-            'video': bool(message.get('video')),
-            'audio': bool(message.get('audio')),
-            'document': bool(message.get('document')),
-            'sticker': bool(message.get('sticker')),
-            'voice': bool(message.get('voice')),
-            'video_note': bool(message.get('video_note')),
-            'contact': bool(message.get('contact')),
-            'location': bool(message.get('geo')),
-            'poll': bool(message.get('poll')),
-            'game': bool(message.get('game'))
-        }
-        
-        return any(media_types.get(media_type, False) for media_type in allowed_types)
+        return any(
+            message.get(self.MEDIA_KEYS[media_type])
+            for media_type in allowed_types
+            if media_type in self.MEDIA_KEYS
+        )
     
     def _filter_by_text_patterns(self, message: Dict[str, Any], patterns: List[str]) -> bool:
         """Фильтрация по текстовым паттернам (регулярные выражения)."""
@@ -55,22 +127,23 @@ class ContentFilter:
         if not text:
             return False
         
-        return any(re.search(pattern, text, re.IGNORECASE) for pattern in patterns)
+        compiled = _compile_patterns(tuple(patterns))
+        return any(pattern.search(text) for pattern in compiled)
     
-    def _filter_by_date_range(self, message: Dict[str, Any], date_range: Dict[str, str]) -> bool:
+    def _filter_by_date_range(self, message: Dict[str, Any], date_range: Dict[str, Any]) -> bool:
         """Фильтрация по диапазону дат."""
         if not date_range:
             return True
         
-        message_date = datetime.fromisoformat(message.get('date', '').replace('Z', '+00:00'))
+        message_date = _to_datetime(message.get('date', ''))
         
-        start_date = None
-        end_date = None
+        start_date = date_range.get('start')
+        end_date = date_range.get('end')
         
-        if 'start' in date_range:
-            start_date = datetime.fromisoformat(date_range['start'])
-        if 'end' in date_range:
-            end_date = datetime.fromisoformat(date_range['end'])
+        if start_date is not None:
+            start_date = _to_datetime(start_date)
+        if end_date is not None:
+            end_date = _to_datetime(end_date)
         
         if start_date and message_date < start_date:
             return False
@@ -79,7 +152,7 @@ class ContentFilter:
         
         return True
     
-    def _filter_by_sender(self, message: Dict[str, Any], sender_ids: List[int]) -> bool:
+    def _filter_by_sender(self, message: Dict[str, Any], sender_ids: FrozenSet[int]) -> bool:
         """Фильтрация по ID отправителя."""
         if not sender_ids:
             return True
@@ -101,8 +174,11 @@ class ContentFilter:
             return True
         
         text = message.get('message', '')
-        url_pattern = r'https?://\S+|www\.\S+'
-        has_url = bool(re.search(url_pattern, text))
+        # Быстрая проверка подстрокой отсекает большинство сообщений без regex
+        if 'http' not in text and 'www.' not in text:
+            has_url = False
+        else:
+            has_url = bool(URL_RE.search(text))
         
         return has_url == has_links
     
@@ -112,8 +188,8 @@ class ContentFilter:
             return True
         
         text = message.get('message', '')
-        mention_pattern = r'@\w+'
-        has_mention = bool(re.search(mention_pattern, text))
+        # Без символа '@' упоминания невозможны, regex не нужен
+        has_mention = '@' in text and bool(MENTION_RE.search(text))
         
         return has_mention == has_mentions
     
@@ -142,6 +218,93 @@ class ContentFilter:
         
         return True
     
+    def compile_filters(self, filters_config: Dict[str, Any]) -> Callable[[Dict[str, Any]], bool]:
+        """
+        Собирает активные фильтры в один предикат для многократного применения.
+        
+        Для конфигурации генерируется функция с прямолинейными проверками:
+        простые фильтры встраиваются в код, значения конфигурации передаются
+        как константы пространства имен. Пользовательские строки в исходный
+        код не попадают.
+        """
+        namespace: Dict[str, Any] = {}
+        body: List[str] = []
+        
+        for index, (filter_name, filter_config) in enumerate(filters_config.items()):
+            if filter_name not in self.filters:
+                continue
+            const = f'_c{index}'
+            
+            if filter_name == 'media_types':
+                if not filter_config:
+                    continue
+                # Типы переводятся в поля сообщения один раз, а не для каждого сообщения
+                media_fields = list(dict.fromkeys(
+                    self.MEDIA_KEYS[media_type]
+                    for media_type in filter_config
+                    if media_type in self.MEDIA_KEYS
+                ))
+                if not media_fields:
+                    body.append('return False')
+                    break
+                checks = ' or '.join(f'message.get({field!r})' for field in media_fields)
+                body.append(f'if not ({checks}): return False')
+            elif filter_name == 'text_patterns':
+                if not filter_config:
+                    continue
+                namespace[const] = _compile_patterns(tuple(filter_config))
+                body.append("text = message.get('message', '')")
+                body.append('if not text: return False')
+                body.append(f'if not any(pattern.search(text) for pattern in {const}): return False')
+            elif filter_name == 'sender_ids':
+                if not filter_config:
+                    continue
+                namespace[const] = frozenset(filter_config)
+                body.append(f"if message.get('sender_info', {{}}).get('id') not in {const}: return False")
+            elif filter_name == 'min_length':
+                if not filter_config:
+                    continue
+                namespace[const] = filter_config
+                body.append(f"if len(message.get('message', '')) < {const}: return False")
+            elif filter_name in ('is_forwarded', 'is_edited'):
+                if filter_config is None:
+                    continue
+                field = 'fwd_from' if filter_name == 'is_forwarded' else 'edit_date'
+                namespace[const] = bool(filter_config)
+                body.append(f'if bool(message.get({field!r})) != {const}: return False')
+            else:
+                # Остальные фильтры вызываются как есть
+                namespace[f'_f{index}'] = self.filters[filter_name]
+                namespace[const] = filter_config
+                body.append(f'if not _f{index}(message, {const}): return False')
+        
+        body.append('return True')
+        source = 'def _filter_chain(message):\n' + ''.join(f'    {line}\n' for line in body)
+        exec(compile(source, '<content_filter>', 'exec'), namespace)
+        return namespace['_filter_chain']
+    
+    def compile_prefilter(self, filters_config: Dict[str, Any]) -> Callable[[Any], bool]:
+        """
+        Собирает предикат для исходного сообщения Telethon из фильтров PREFILTERS.
+        
+        Сообщения, не прошедшие его, отбрасываются до построения словаря
+        сообщения и информации об отправителе. Проверки те же, что в
+        compile_filters, - они применяются к словарю из нужных атрибутов.
+        """
+        check = self.compile_filters({
+            name: value for name, value in filters_config.items() if name in self.PREFILTERS
+        })
+        
+        def prefilter(message) -> bool:
+            return check({
+                'date': message.date,
+                'message': message.message or '',
+                'fwd_from': message.fwd_from,
+                'edit_date': message.edit_date
+            })
+        
+        return prefilter
+    
     def create_filter_config(self, **kwargs) -> Dict[str, Any]:
         """Создает конфигурацию фильтров из параметров."""
         config = {}
@@ -153,10 +316,15 @@ class ContentFilter:
             config['text_patterns'] = kwargs['text_patterns']
         
         if 'date_range' in kwargs:
-            config['date_range'] = kwargs['date_range']
+            # Границы диапазона разбираются один раз, а не для каждого сообщения
+            date_range = dict(kwargs['date_range'])
+            for key in ('start', 'end'):
+                if date_range.get(key) is not None:
+                    date_range[key] = _to_datetime(date_range[key])
+            config['date_range'] = date_range
         
         if 'sender_ids' in kwargs:
-            config['sender_ids'] = kwargs['sender_ids']
+            config['sender_ids'] = frozenset(kwargs['sender_ids'] or ())
         
         if 'min_length' in kwargs:
             config['min_length'] = kwargs['min_length']
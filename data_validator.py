@@ -5,13 +5,37 @@
 
 import re
 import html
-from typing import Dict, Any, List, Optional, Tuple
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Iterable, Iterator, Union
 from datetime import datetime
 import logging
 
+# Регулярные выражения компилируются один раз при импорте модуля
+WHITESPACE_RE = re.compile(r'\s+')
+# Признаки текста, требующего очистки: управляющие символы, повторные
+# или нестандартные пробелы, пробелы по краям
+NEEDS_CLEANUP_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]|\s{2,}|[^\S ]|^\s|\s$')
+
+# Невидимые управляющие символы. Регулярное выражение, а не str.translate:
+# translate с таблицей-словарем медленно обрабатывает не-ASCII текст
+CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+
+@lru_cache(maxsize=8192)
+def _parse_iso(date_str: str) -> datetime:
+    """Разбирает дату в формате ISO (повторяющиеся строки берутся из кэша)."""
+    return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+
 class DataValidator:
     """Валидация и очистка данных сообщений."""
     
+    # Обязательные поля сообщения (порядок задает, о каком поле сообщить первым)
+    REQUIRED_FIELD_ORDER = ('id', 'date', 'message')
+    REQUIRED_FIELDS = frozenset(REQUIRED_FIELD_ORDER)
+    
+    # Поля медиа, удаляемые из сообщения, если они пустые
+    MEDIA_KEYS = frozenset(('photo', 'video', 'audio', 'document', 'sticker'))
+    
     def __init__(self, config: Dict[str, Any] = None):
         self.config = config or {}
         self.logger = logging.getLogger('telegram_downloader.validator')
@@ -24,15 +48,17 @@ class DataValidator:
         self.validate_dates = self.config.get('validate_dates', True)
         self.clean_html = self.config.get('clean_html', True)
         self.remove_duplicates = self.config.get('remove_duplicates', True)
+        
+        # Ошибки последнего прохода iter_validate_and_clean
+        self.last_errors: List[Dict[str, Any]] = []
     
     def validate_message(self, message: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
         """Валидирует одно сообщение."""
         try:
             # Проверка обязательных полей
-            required_fields = ['id', 'date', 'message']
-            for field in required_fields:
-                if field not in message:
-                    return False, f"Отсутствует обязательное поле: {field}"
+            if not message.keys() >= self.REQUIRED_FIELDS:
+                missing = next(field for field in self.REQUIRED_FIELD_ORDER if field not in message)
+                return False, f"Отсутствует обязательное поле: {missing}"
             
             # Проверка ID
             if not isinstance(message['id'], int) or message['id'] <= 0:
@@ -43,7 +69,7 @@ class DataValidator:
                 try:
                     date_str = message['date']
                     if isinstance(date_str, str):
-                        datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+                        _parse_iso(date_str)
                 except (ValueError, TypeError):
                     return False, "Неверный формат даты"
             
@@ -69,23 +95,30 @@ class DataValidator:
         except Exception as e:
             return False, f"Ошибка валидации: {str(e)}"
     
-    def clean_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
-        """Очищает и нормализует данные сообщения."""
-        cleaned = message.copy()
+    def clean_message(self, message: Dict[str, Any], inplace: bool = False) -> Dict[str, Any]:
+        """
+        Очищает и нормализует данные сообщения.
+        
+        Args:
+            message: Сообщение для очистки
+            inplace: Изменять переданный словарь вместо создания копии
+        """
+        cleaned = message if inplace else message.copy()
         
         # Очистка текста
-        if 'message' in cleaned and isinstance(cleaned['message'], str):
-            text = cleaned['message']
-            
+        text = cleaned.get('message')
+        if isinstance(text, str) and (
+            (self.clean_html and '&' in text) or NEEDS_CLEANUP_RE.search(text)
+        ):
             # Декодирование HTML entities
             if self.clean_html:
                 text = html.unescape(text)
             
-            # Удаление лишних пробелов
-            text = re.sub(r'\s+', ' ', text).strip()
-            
             # Удаление невидимых символов
-            text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
+            text = CONTROL_CHARS_RE.sub('', text)
+            
+            # Удаление лишних пробелов
+            text = WHITESPACE_RE.sub(' ', text).strip()
             
             cleaned['message'] = text
         
@@ -94,7 +127,7 @@ class DataValidator:
             date_str = cleaned['date']
             if isinstance(date_str, str):
                 try:
-                    dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+                    dt = _parse_iso(date_str)
                     cleaned['date'] = dt.isoformat()
                 except:
                     pass
@@ -102,14 +135,14 @@ class DataValidator:
         # Очистка информации об отправителе
         if 'sender_info' in cleaned:
             sender_info = cleaned['sender_info']
-            if isinstance(sender_info, dict):
+            if isinstance(sender_info, dict) and None in sender_info.values():
                 # Удаление пустых полей
                 sender_info = {k: v for k, v in sender_info.items() if v is not None}
                 cleaned['sender_info'] = sender_info
         
         # Очистка медиа информации
-        for media_key in ['photo', 'video', 'audio', 'document', 'sticker']:
-            if media_key in cleaned and not cleaned[media_key]:
+        for media_key in self.MEDIA_KEYS & cleaned.keys():
+            if not cleaned[media_key]:
                 del cleaned[media_key]
         
         return cleaned
@@ -119,17 +152,12 @@ class DataValidator:
         if not self.remove_duplicates:
             return messages
         
-        seen_ids = set()
-        unique_messages = []
-        
+        # dict сохраняет порядок вставки; сообщения без ID (например, системные)
+        # получают уникальный ключ и всегда остаются в списке
+        unique_by_key = {}
         for message in messages:
-            message_id = message.get('id')
-            if message_id and message_id not in seen_ids:
-                seen_ids.add(message_id)
-                unique_messages.append(message)
-            elif not message_id:
-                # Сообщения без ID добавляем (например, системные)
-                unique_messages.append(message)
+            unique_by_key.setdefault(message.get('id') or (None, id(message)), message)
+        unique_messages = list(unique_by_key.values())
         
         removed_count = len(messages) - len(unique_messages)
         if removed_count > 0:
@@ -139,17 +167,29 @@ class DataValidator:
     
     def validate_and_clean_batch(
         self,
-        messages: List[Dict[str, Any]]
+        messages: List[Dict[str, Any]],
+        parallel: Union[bool, int] = False
     ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-        """Валидирует и очищает пакет сообщений."""
+        """
+        Валидирует и очищает пакет сообщений.
+        
+        Args:
+            messages: Список сообщений
+            parallel: Распределить обработку по процессам (True - по числу ядер,
+                число - количество процессов). Имеет смысл для пакетов от ~10 тыс.
+        """
+        if not parallel:
+            valid_messages = list(self.iter_validate_and_clean(messages))
+            return valid_messages, self.last_errors
+        
+        max_workers = None if parallel is True else int(parallel)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(self._validate_and_clean_one, messages, chunksize=1000))
+        
         valid_messages = []
         invalid_messages = []
-        
-        for message in messages:
-            is_valid, error = self.validate_message(message)
-            
-            if is_valid:
-                cleaned = self.clean_message(message)
+        for message, (cleaned, error) in zip(messages, results):
+            if error is None:
                 valid_messages.append(cleaned)
             else:
                 invalid_messages.append({
@@ -158,11 +198,65 @@ class DataValidator:
                 })
                 self.logger.warning(f"Невалидное сообщение: {error}")
         
-        # Удаление дубликатов
+        # Удаление дубликатов выполняется в основном процессе
         valid_messages = self.remove_duplicates_from_list(valid_messages)
+        self.last_errors = invalid_messages
         
         return valid_messages, invalid_messages
     
+    def _validate_and_clean_one(
+        self,
+        message: Dict[str, Any]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Валидирует и очищает одно сообщение (выполняется в рабочем процессе)."""
+        is_valid, error = self.validate_message(message)
+        if not is_valid:
+            return None, error
+        return self.clean_message(message, inplace=True), None
+    
+    def iter_validate_and_clean(
+        self,
+        messages: Iterable[Dict[str, Any]]
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Потоково валидирует и очищает сообщения.
+        
+        Дубликаты отбрасываются по ходу обработки, поэтому в памяти хранятся
+        только ID уже выданных сообщений. Невалидные сообщения накапливаются
+        в self.last_errors.
+        
+        Yields:
+            Очищенные валидные сообщения
+        """
+        self.last_errors = []
+        seen_ids = set()
+        removed_count = 0
+        
+        for message in messages:
+            is_valid, error = self.validate_message(message)
+            
+            if not is_valid:
+                self.last_errors.append({
+                    'message': message,
+                    'error': error
+                })
+                self.logger.warning(f"Невалидное сообщение: {error}")
+                continue
+            
+            # Удаление дубликатов (сообщения без ID не отбрасываются)
+            message_id = message.get('id')
+            if self.remove_duplicates and message_id:
+                if message_id in seen_ids:
+                    removed_count += 1
+                    continue
+                seen_ids.add(message_id)
+            
+            # Исходные словари после валидации не используются, очищаем на месте
+            yield self.clean_message(message, inplace=True)
+        
+        if removed_count > 0:
+            self.logger.info(f"Удалено дубликатов: {removed_count}")
+    
     def get_validation_stats(
         self,
         original_count: int,
@@ -194,16 +288,16 @@ class DataValidator:
         output_file: str = "validation_report.json"
     ) -> None:
         """Экспортирует отчет о валидации."""
-        import json
+        import orjson
         
         report = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.now(),
             'validation_config': self.config,
             'statistics': stats,
             'error_breakdown': stats['error_reasons']
         }
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(report, f, indent=2, ensure_ascii=False)
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         
         self.logger.info(f"Отчет о валидации сохранен: {output_file}")
\ No newline at end of file
@@ -3,406 +3,664 @@
 Поддерживает JSON, CSV, Excel, HTML и другие форматы.
 """
 
-import json
+import asyncio
 import csv
-import pandas as pd
+import html
+import orjson
+import openpyxl
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
 from pathlib import Path
-from typing import Dict, Any, List, Optional
-import aiofiles
+from typing import Dict, Any, List, Optional, Callable, Iterator, Sequence
 from datetime import datetime
+from functools import lru_cache, partial
+import io
+import math
+import os
+import re
+import zipfile
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
+from xml.sax.saxutils import escape as xml_escape
+
+try:
+    # Необязательное скомпилированное расширение (см. setup.py)
+    from _export_fast import flatten_dict as _fast_flatten_dict, dict_to_xml as _fast_dict_to_xml
+except ImportError:
+    _fast_flatten_dict = None
+    _fast_dict_to_xml = None
+
+# Служебные части минимального XLSX-контейнера для прямой записи
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+# Стиль 1 - формат даты и времени
+_XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+    '<borders count="1"><border/></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_XLSX_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_XLSX_SHEET_TAIL = '</sheetData></worksheet>'
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+# Символы, недопустимые в XML 1.0 (регулярное выражение быстрее str.translate на не-ASCII тексте)
+_XML_ILLEGAL_CHARS_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F]')
+
+@lru_cache(maxsize=None)
+def _media_file_exists(file_path: str) -> bool:
+    """Проверяет существование медиафайла (кэш сбрасывается перед каждым экспортом)."""
+    return os.path.exists(file_path)
+
+@lru_cache(maxsize=None)
+def _relative_media_path(file_path: str) -> str:
+    """Создает относительный путь от HTML файла к медиафайлу."""
+    # Разбор строки без создания Path; обратные слеши считаются разделителями
+    parts = [part for part in file_path.replace('\\', '/').split('/') if part]
+    
+    # Если файл находится в downloads/media/*, берем путь от 'media' включительно
+    if 'downloads' in parts and 'media' in parts:
+        return '/'.join(parts[parts.index('media'):])
+    
+    # Для других случаев используем только имя файла
+    return parts[-1] if parts else ''
 
 class ExportManager:
     """Управляет экспортом данных в различные форматы."""
     
+    # Начиная с этого числа строк XLSX пишется напрямую, без Excel-библиотек
+    EXCEL_DIRECT_THRESHOLD = 10_000
+    
+    # Статичные начало и конец HTML-документа (стили, модальное окно, скрипты)
+    _HTML_HEAD = '\n'.join([
+        '<!DOCTYPE html>',
+        '<html lang="ru">',
+        '<head>',
+        '<meta charset="UTF-8">',
+        '<meta name="viewport" content="width=device-width, initial-scale=1.0">',
+        '<title>Telegram Messages Export</title>',
+        '<style>',
+        'body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }',
+        '.message { border: 1px solid #ddd; margin: 10px 0; padding: 15px; border-radius: 5px; background-color: white; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }',
+        '.message-header { font-weight: bold; margin-bottom: 10px; color: #2c3e50; }',
+        '.message-content { margin: 10px 0; white-space: pre-wrap; }',
+        '.message-date { color: #666; font-size: 0.9em; margin-bottom: 10px; }',
+        '.message-media { margin-top: 15px; padding-top: 10px; border-top: 1px solid #eee; }',
+        '.message-media img { border-radius: 5px; margin: 5px; cursor: pointer; transition: transform 0.2s; max-width: 300px; max-height: 300px; }',
+        '.message-media img:hover { transform: scale(1.02); }',
+        '.message-media video { border-radius: 5px; margin: 5px; max-width: 400px; max-height: 400px; }',
+        '.message-media audio { margin: 5px; }',
+        '.message-media a { color: #3498db; text-decoration: none; display: inline-block; margin: 5px; padding: 8px 12px; background-color: #f8f9fa; border-radius: 4px; border: 1px solid #dee2e6; }',
+        '.message-media a:hover { text-decoration: underline; background-color: #e9ecef; }',
+        '.media-error { color: #e74c3c; font-style: italic; }',
+        '.modal { display: none; position: fixed; z-index: 1000; left: 0; top: 0; width: 100%; height: 100%; background-color: rgba(0,0,0,0.9); }',
+        '.modal-content { margin: auto; display: block; max-width: 90%; max-height: 90%; margin-top: 40px; }',
+        '.modal-content-file { margin: auto; display: block; width: 80%; height: 80%; margin-top: 40px; background-color: white; border-radius: 8px; padding: 20px; overflow: auto; }',
+        '.close { position: absolute; top: 15px; right: 35px; color: #f1f1f1; font-size: 40px; font-weight: bold; cursor: pointer; }',
+        '.close:hover, .close:focus { color: #bbb; text-decoration: none; }',
+        '.modal-caption { margin: auto; display: block; width: 80%; max-width: 700px; text-align: center; color: #ccc; padding: 10px 0; }',
+        '.modal-download { position: absolute; bottom: 20px; right: 20px; padding: 10px 15px; background-color: #4CAF50; color: white; border: none; border-radius: 4px; cursor: pointer; text-decoration: none; }',
+        '.modal-download:hover { background-color: #45a049; }',
+        '</style>',
+        '</head>',
+        '<body>',
+        '<h1>Экспорт сообщений Telegram</h1>'
+    ]) + '\n'
+    _HTML_FOOTER = '\n'.join([
+        '<!-- Модальное окно для просмотра медиа -->',
+        '<div id="mediaModal" class="modal">',
+        '  <span class="close">&times;</span>',
+        '  <div id="modalContentContainer"></div>',
+        '  <div id="modalCaption" class="modal-caption"></div>',
+        '  <a id="modalDownload" class="modal-download" download>Скачать</a>',
+        '</div>',
+        
+        '<script>',
+        '// Получаем модальное окно',
+        'var modal = document.getElementById("mediaModal");',
+        '// Получаем элемент для закрытия модального окна',
+        'var span = document.getElementsByClassName("close")[0];',
+        '// Получаем контейнер для контента',
+        'var modalContentContainer = document.getElementById("modalContentContainer");',
+        '// Получаем элемент для подписи',
+        'var modalCaption = document.getElementById("modalCaption");',
+        '// Получаем элемент для скачивания',
+        'var modalDownload = document.getElementById("modalDownload");',
+        '',
+        '// Функция для открытия изображения',
+        'function openImage(src, caption, downloadUrl) {',
+        '  modalContentContainer.innerHTML = \'<img class="modal-content" src="\' + src + \'">\';',
+        '  modalCaption.textContent = caption;',
+        '  modalDownload.href = downloadUrl;',
+        '  modal.style.display = "block";',
+        '}',
+        '',
+        '// Функция для открытия видео',
+        'function openVideo(src, caption, downloadUrl) {',
+        '  modalContentContainer.innerHTML = \'<video class="modal-content" controls autoplay><source src="\' + src + \'">Ваш браузер не поддерживает видео тег.</video>\';',
+        '  modalCaption.textContent = caption;',
+        '  modalDownload.href = downloadUrl;',
+        '  modal.style.display = "block";',
+        '}',
+        '',
+        '// Функция для открытия аудио',
+        'function openAudio(src, caption, downloadUrl) {',
+        '  modalContentContainer.innerHTML = \'<audio class="modal-content" controls autoplay><source src="\' + src + \'">Ваш браузер не поддерживает аудио тег.</audio>\';',
+        '  modalCaption.textContent = caption;',
+        '  modalDownload.href = downloadUrl;',
+        '  modal.style.display = "block";',
+        '}',
+        '',
+        '// Функция для открытия файла',
+        'function openFile(src, caption, downloadUrl) {',
+        '  modalContentContainer.innerHTML = \'<div class="modal-content-file"><iframe src="\' + src + \'" style="width: 100%; height: 100%; border: none;"></iframe></div>\';',
+        '  modalCaption.textContent = caption;',
+        '  modalDownload.href = downloadUrl;',
+        '  modal.style.display = "block";',
+        '}',
+        '',
+        '// Когда пользователь нажимает на (x), закрываем модальное окно',
+        'span.onclick = function() {',
+        '  modal.style.display = "none";',
+        '  // Останавливаем видео/аудио при закрытии',
+        '  var mediaElements = modalContentContainer.querySelectorAll("video, audio");',
+        '  mediaElements.forEach(function(element) {',
+        '    element.pause();',
+        '    element.currentTime = 0;',
+        '  });',
+        '}',
+        '',
+        '// Когда пользователь нажимает в любом месте за пределами модального окна, закрываем его',
+        'window.onclick = function(event) {',
+        '  if (event.target == modal) {',
+        '    modal.style.display = "none";',
+        '    // Останавливаем видео/аудио при закрытии',
+        '    var mediaElements = modalContentContainer.querySelectorAll("video, audio");',
+        '    mediaElements.forEach(function(element) {',
+        '      element.pause();',
+        '      element.currentTime = 0;',
+        '    });',
+        '  }',
+        '}',
+        '</script>',
+        '</body>',
+        '</html>'
+    ])
+    
+    # Шаблоны HTML для медиафайлов по типу; {style} задается только для элементов альбома,
+    # {js_path}/{js_name} - экранированные значения для обработчиков onclick
+    _HTML_MEDIA_TEMPLATES = {
+        'photo': '<img src="{path}" alt="Photo" onclick="openImage(\'{js_path}\', \'{js_name}\', \'{js_path}\')" title="Нажмите для увеличения"{style}>\n',
+        'video': '<video controls onclick="openVideo(\'{js_path}\', \'{js_name}\', \'{js_path}\')" title="Нажмите для увеличения"{style}><source src="{path}" type="video/mp4">Your browser does not support the video tag.</video>\n',
+        'audio': '<audio controls onclick="openAudio(\'{js_path}\', \'{js_name}\', \'{js_path}\')" title="Нажмите для открытия в плеере"{style}><source src="{path}" type="audio/mpeg">Your browser does not support the audio tag.</audio>\n',
+        'document': '<a href="#" onclick="openFile(\'{js_path}\', \'{js_name}\', \'{js_path}\'); return false;"{style}>📄 Открыть документ: {name}</a>\n',
+        'voice': '<audio controls onclick="openAudio(\'{js_path}\', \'Голосовое сообщение: {js_name}\', \'{js_path}\')" title="Нажмите для открытия в плеере"{style}><source src="{path}" type="audio/ogg">Your browser does not support the audio tag.</audio>\n',
+    }
+    # Для других типов файлов
+    _HTML_MEDIA_DEFAULT = '<a href="#" onclick="openFile(\'{js_path}\', \'{js_name}\', \'{js_path}\'); return false;"{style}>📎 Открыть файл: {name}</a>\n'
+    _HTML_ALBUM_STYLES = {
+        'photo': ' style="max-width: 300px; max-height: 300px; margin: 5px;"',
+        'video': ' style="max-width: 400px; max-height: 400px; margin: 5px;"',
+    }
+    _HTML_ALBUM_DEFAULT_STYLE = ' style="margin: 5px;"'
+    
+    # Подписи ссылок на медиафайлы в Markdown
+    _MD_MEDIA_LABELS = {
+        'photo': '![Фото]',
+        'video': '[Видео]',
+        'audio': '[Аудио]',
+        'document': '[Документ]',
+        'voice': '[Голосовое сообщение]',
+    }
+    
     def __init__(self, output_dir: str = "downloads"):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
     
-    def _get_output_path(self, base_name: str, extension: str) -> Path:
-        """Возвращает путь для выходного файла."""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    def _get_output_path(self, base_name: str, extension: str, timestamp: Optional[str] = None) -> Path:
+        """Возвращает путь для выходного файла (с текущим временем, если timestamp не задан)."""
+        if timestamp is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{base_name}_{timestamp}.{extension}"
         return self.output_dir / filename
     
-    async def export_json(self, data: List[Dict[str, Any]], filename: str = "messages") -> str:
+    async def _write_bytes(self, output_path: Path, content: bytes) -> None:
+        """Записывает байты в файл одной операцией в отдельном потоке."""
+        await asyncio.to_thread(output_path.write_bytes, content)
+    
+    def _render_to_file(
+        self,
+        render: Callable[[List[Dict[str, Any]]], str],
+        data: List[Dict[str, Any]],
+        output_path: Path
+    ) -> None:
+        """Формирует содержимое и записывает его в файл (вызывается в отдельном потоке)."""
+        # Генерация и запись идут одним переходом в поток, не занимая цикл событий
+        output_path.write_text(render(data), encoding='utf-8')
+    
+    async def export_json(
+        self,
+        data: List[Dict[str, Any]],
+        filename: str = "messages",
+        timestamp: Optional[str] = None
+    ) -> str:
         """Экспорт в JSON формат."""
-        output_path = self._get_output_path(filename, "json")
+        output_path = self._get_output_path(filename, "json", timestamp)
         
-        async with aiofiles.open(output_path, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(
-                data,
-                indent=2,
-                ensure_ascii=False,
-                default=self._json_serializer
-            ))
+        await self._write_bytes(output_path, orjson.dumps(
+            data,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS,
+            default=str
+        ))
         
         return str(output_path)
     
-    async def export_jsonl(self, data: List[Dict[str, Any]], filename: str = "messages") -> str:
+    async def export_jsonl(
+        self,
+        data: List[Dict[str, Any]],
+        filename: str = "messages",
+        timestamp: Optional[str] = None
+    ) -> str:
         """Экспорт в JSON Lines формат."""
-        output_path = self._get_output_path(filename, "jsonl")
-        
-        async with aiofiles.open(output_path, 'w', encoding='utf-8') as f:
-            for item in data:
-                json_line = json.dumps(item, ensure_ascii=False, default=self._json_serializer)
-                await f.write(json_line + '\n')
+        output_path = self._get_output_path(filename, "jsonl", timestamp)
+        
+        # Все строки собираются заранее и записываются одним вызовом
+        payload = b''.join(
+            orjson.dumps(
+                item,
+                option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS,
+                default=str
+            )
+            for item in data
+        )
+        await self._write_bytes(output_path, payload)
         
         return str(output_path)
     
-    async def export_csv(self, data: List[Dict[str, Any]], filename: str = "messages") -> str:
+    async def export_csv(
+        self,
+        data: List[Dict[str, Any]],
+        filename: str = "messages",
+        timestamp: Optional[str] = None
+    ) -> str:
         """Экспорт в CSV формат."""
-        if not data:
+        return await self._export_csv_flat(self._flatten_rows(data), filename, timestamp)
+    
+    async def _export_csv_flat(
+        self,
+        flat_data: List[Dict[str, Any]],
+        filename: str,
+        timestamp: Optional[str] = None
+    ) -> str:
+        """Экспорт в CSV уже развернутых в плоский вид записей."""
+        if not flat_data:
             raise ValueError("Нет данных для экспорта")
         
-        output_path = self._get_output_path(filename, "csv")
+        output_path = self._get_output_path(filename, "csv", timestamp)
         
-        # Подготовка данных для CSV
-        flat_data = []
-        for item in data:
-            flat_item = self._flatten_dict(item)
-            flat_data.append(flat_item)
-        
-        # Получение всех возможных колонок
-        all_keys = set()
-        for item in flat_data:
-            all_keys.update(item.keys())
+        # Колонки в порядке первого появления ключей (как в Excel), без сортировки
+        columns = list(dict.fromkeys(key for item in flat_data for key in item))
         
-        columns = sorted(all_keys)
-        
-        async with aiofiles.open(output_path, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=columns)
-            await writer.writeheader()
-            
-            for item in flat_data:
-                # Обработка None значений
-                safe_item = {k: str(v) if v is not None else '' for k, v in item.items()}
-                await writer.writerow(safe_item)
+        await asyncio.to_thread(self._write_csv, output_path, columns, flat_data)
         
         return str(output_path)
     
-    async def export_excel(self, data: List[Dict[str, Any]], filename: str = "messages") -> str:
+    def _write_csv(self, output_path: Path, columns: List[str], rows: List[Dict[str, Any]]) -> None:
+        """Записывает CSV одним синхронным проходом (вызывается в отдельном потоке)."""
+        with open(output_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            # Обработка None и отсутствующих значений
+            writer.writerows(
+                ['' if row.get(column) is None else str(row[column]) for column in columns]
+                for row in rows
+            )
+    
+    async def export_excel(
+        self,
+        data: List[Dict[str, Any]],
+        filename: str = "messages",
+        timestamp: Optional[str] = None
+    ) -> str:
         """Экспорт в Excel формат."""
-        if not data:
+        return await self._export_excel_flat(self._flatten_rows(data), filename, timestamp)
+    
+    async def _export_excel_flat(
+        self,
+        flat_data: List[Dict[str, Any]],
+        filename: str,
+        timestamp: Optional[str] = None
+    ) -> str:
+        """Экспорт в Excel уже развернутых в плоский вид записей."""
+        if not flat_data:
             raise ValueError("Нет данных для экспорта")
         
-        output_path = self._get_output_path(filename, "xlsx")
-        
-        # Подготовка данных
-        flat_data = []
-        for item in data:
-            flat_item = self._flatten_dict(item)
-            flat_data.append(flat_item)
+        output_path = self._get_output_path(filename, "xlsx", timestamp)
         
-        # Создание DataFrame
-        df = pd.DataFrame(flat_data)
+        # Колонки в порядке первого появления ключей
+        columns = list(dict.fromkeys(key for item in flat_data for key in item))
         
-        # Экспорт в Excel
-        df.to_excel(output_path, index=False, engine='openpyxl')
+        await asyncio.to_thread(self._write_excel, output_path, columns, flat_data)
         
         return str(output_path)
     
-    async def export_html(self, data: List[Dict[str, Any]], filename: str = "messages") -> str:
+    def _write_excel(self, output_path: Path, columns: List[str], rows: List[Dict[str, Any]]) -> None:
+        """
+        Потоково записывает строки в XLSX.
+        
+        Большие выгрузки пишутся напрямую как XML (_write_xlsx_direct).
+        Иначе, если установлен xlsxwriter, используется он (режим
+        constant_memory, в несколько раз быстрее), иначе - write-only книга
+        openpyxl.
+        """
+        if len(rows) > self.EXCEL_DIRECT_THRESHOLD:
+            self._write_xlsx_direct(output_path, columns, rows)
+            return
+        
+        if xlsxwriter is not None:
+            workbook = xlsxwriter.Workbook(str(output_path), {
+                'constant_memory': True,
+                'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+                # Текст сообщений пишется как есть, без превращения в формулы/ссылки
+                'strings_to_formulas': False,
+                'strings_to_urls': False
+            })
+            sheet = workbook.add_worksheet('Sheet1')
+            sheet.write_row(0, 0, columns)
+            for row_index, row in enumerate(rows, 1):
+                sheet.write_row(row_index, 0, [self._excel_value(row.get(column)) for column in columns])
+            workbook.close()
+            return
+        
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('Sheet1')
+        sheet.append(columns)
+        for row in rows:
+            sheet.append([self._excel_value(row.get(column)) for column in columns])
+        workbook.save(output_path)
+    
+    def _write_xlsx_direct(self, output_path: Path, columns: List[str], rows: List[Dict[str, Any]]) -> None:
+        """Записывает XLSX, формируя XML листа построчно и упаковывая его в zip."""
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES)
+            archive.writestr('_rels/.rels', _XLSX_ROOT_RELS)
+            archive.writestr('xl/workbook.xml', _XLSX_WORKBOOK)
+            archive.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS)
+            archive.writestr('xl/styles.xml', _XLSX_STYLES)
+            
+            with archive.open('xl/worksheets/sheet1.xml', 'w') as raw:
+                sheet = io.TextIOWrapper(raw, encoding='utf-8')
+                sheet.write(_XLSX_SHEET_HEAD)
+                sheet.write('<row>' + ''.join(self._xlsx_cell(column) for column in columns) + '</row>')
+                for row in rows:
+                    sheet.write(
+                        '<row>'
+                        + ''.join(self._xlsx_cell(self._excel_value(row.get(column))) for column in columns)
+                        + '</row>'
+                    )
+                sheet.write(_XLSX_SHEET_TAIL)
+                sheet.flush()
+                sheet.detach()
+    
+    def _xlsx_cell(self, value: Any) -> str:
+        """Возвращает XML одной ячейки листа."""
+        if value is None:
+            return '<c/>'
+        if isinstance(value, bool):
+            return f'<c t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, int) or (isinstance(value, float) and math.isfinite(value)):
+            return f'<c><v>{value}</v></c>'
+        if isinstance(value, datetime):
+            serial = (value - _EXCEL_EPOCH).total_seconds() / 86400
+            return f'<c s="1"><v>{serial}</v></c>'
+        text = xml_escape(_XML_ILLEGAL_CHARS_RE.sub('', str(value)))
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+    
+    def _excel_value(self, value: Any) -> Any:
+        """Приводит значение к типу, поддерживаемому ячейкой Excel."""
+        if value is None or isinstance(value, (str, int, float)):
+            return value
+        if isinstance(value, datetime):
+            # Excel не хранит часовой пояс
+            return value.replace(tzinfo=None) if value.tzinfo else value
+        return str(value)
+    
+    async def export_html(
+        self,
+        data: List[Dict[str, Any]],
+        filename: str = "messages",
+        view: Optional[Dict[str, List[Any]]] = None,
+        timestamp: Optional[str] = None
+    ) -> str:
         """Экспорт в HTML формат."""
-        output_path = self._get_output_path(filename, "html")
-        
-        html_content = self._generate_html(data)
+        output_path = self._get_output_path(filename, "html", timestamp)
         
-        async with aiofiles.open(output_path, 'w', encoding='utf-8') as f:
-            await f.write(html_content)
+        await asyncio.to_thread(self._render_to_file, partial(self._generate_html, view=view), data, output_path)
         
         return str(output_path)
     
-    async def export_xml(self, data: List[Dict[str, Any]], filename: str = "messages") -> str:
+    async def export_xml(
+        self,
+        data: List[Dict[str, Any]],
+        filename: str = "messages",
+        timestamp: Optional[str] = None
+    ) -> str:
         """Экспорт в XML формат."""
-        output_path = self._get_output_path(filename, "xml")
+        output_path = self._get_output_path(filename, "xml", timestamp)
+        
+        await asyncio.to_thread(self._render_to_file, self._generate_xml, data, output_path)
         
+        return str(output_path)
+    
+    def _generate_xml(self, data: List[Dict[str, Any]]) -> str:
+        """Генерирует XML контент."""
         root = ET.Element("messages")
         
         for item in data:
             message_elem = ET.SubElement(root, "message")
             self._dict_to_xml(message_elem, item)
         
-        # Форматирование XML
-        xml_str = ET.tostring(root, encoding='unicode')
-        dom = minidom.parseString(xml_str)
-        pretty_xml = dom.toprettyxml(indent="  ")
-        
-        async with aiofiles.open(output_path, 'w', encoding='utf-8') as f:
-            await f.write(pretty_xml)
-        
-        return str(output_path)
+        # Форматирование XML без повторного разбора документа
+        ET.indent(root, space="  ")
+        return '<?xml version="1.0" ?>\n' + ET.tostring(root, encoding='unicode') + '\n'
     
-    async def export_markdown(self, data: List[Dict[str, Any]], filename: str = "messages") -> str:
+    async def export_markdown(
+        self,
+        data: List[Dict[str, Any]],
+        filename: str = "messages",
+        view: Optional[Dict[str, List[Any]]] = None,
+        timestamp: Optional[str] = None
+    ) -> str:
         """Экспорт в Markdown формат."""
-        output_path = self._get_output_path(filename, "md")
+        output_path = self._get_output_path(filename, "md", timestamp)
         
-        md_content = self._generate_markdown(data)
-        
-        async with aiofiles.open(output_path, 'w', encoding='utf-8') as f:
-            await f.write(md_content)
+        await asyncio.to_thread(self._render_to_file, partial(self._generate_markdown, view=view), data, output_path)
         
         return str(output_path)
     
+    def _flatten_rows(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Разворачивает все записи в плоские словари для табличных форматов."""
+        return [self._flatten_dict(item) for item in data]
+    
     def _flatten_dict(self, d: Dict[str, Any], parent_key: str = '', sep: str = '_') -> Dict[str, Any]:
         """Преобразует вложенный словарь в плоский."""
-        items = []
-        for k, v in d.items():
-            new_key = f"{parent_key}{sep}{k}" if parent_key else k
-            if isinstance(v, dict):
-                items.extend(self._flatten_dict(v, new_key, sep=sep).items())
-            elif isinstance(v, list) and v and isinstance(v[0], dict):
-                # Для списков словарей создаем отдельные колонки
-                for i, item in enumerate(v):
-                    items.extend(self._flatten_dict(item, f"{new_key}_{i}", sep=sep).items())
+        if _fast_flatten_dict is not None and type(d) is dict:
+            return _fast_flatten_dict(d, parent_key, sep)
+        
+        # Обход в глубину через явный стек итераторов сохраняет порядок ключей
+        # без рекурсивных вызовов и промежуточных словарей
+        flat = {}
+        stack = [(parent_key, iter(d.items()))]
+        while stack:
+            prefix, items = stack[-1]
+            for k, v in items:
+                new_key = f"{prefix}{sep}{k}" if prefix else k
+                if type(v) is dict:
+                    stack.append((new_key, iter(v.items())))
+                    break
+                if type(v) is list and v and type(v[0]) is dict:
+                    # Для списков словарей создаем отдельные колонки
+                    stack.append((new_key, enumerate(v)))
+                    break
+                flat[new_key] = v
             else:
-                items.append((new_key, v))
-        return dict(items)
+                stack.pop()
+        return flat
     
-    def _json_serializer(self, obj):
-        """Сериализатор для JSON."""
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return str(obj)
+    def _prepare_view(self, data: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+        """Один раз извлекает имена отправителей и списки медиафайлов для HTML и Markdown."""
+        return {
+            'sender_names': [self._sender_name(item.get('sender_info', {})) for item in data],
+            'media': [self._media_list(item.get('media_info')) for item in data],
+        }
     
-    def _generate_html(self, data: List[Dict[str, Any]]) -> str:
+    def _view_rows(self, data: List[Dict[str, Any]], view: Optional[Dict[str, List[Any]]]) -> List[tuple]:
+        """Возвращает тройки (сообщение, имя отправителя, медиафайлы)."""
+        if view is None:
+            view = self._prepare_view(data)
+        return list(zip(data, view['sender_names'], view['media']))
+    
+    @staticmethod
+    def _sender_name(sender_info: Dict[str, Any]) -> str:
+        """Возвращает отображаемое имя отправителя."""
+        return sender_info.get('title') or f"{sender_info.get('first_name', '')} {sender_info.get('last_name', '')}".strip()
+    
+    @staticmethod
+    def _media_list(media_info: Any) -> Sequence[Dict[str, Any]]:
+        """Приводит media_info к последовательности; альбом остается списком."""
+        if isinstance(media_info, dict):
+            return (media_info,)
+        if isinstance(media_info, list):
+            return media_info
+        return ()
+    
+    def _generate_html(self, data: List[Dict[str, Any]], view: Optional[Dict[str, List[Any]]] = None) -> str:
         """Генерирует HTML контент."""
-        html_parts = [
-            '<!DOCTYPE html>',
-            '<html lang="ru">',
-            '<head>',
-            '<meta charset="UTF-8">',
-            '<meta name="viewport" content="width=device-width, initial-scale=1.0">',
-            '<title>Telegram Messages Export</title>',
-            '<style>',
-            'body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }',
-            '.message { border: 1px solid #ddd; margin: 10px 0; padding: 15px; border-radius: 5px; background-color: white; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }',
-            '.message-header { font-weight: bold; margin-bottom: 10px; color: #2c3e50; }',
-            '.message-content { margin: 10px 0; white-space: pre-wrap; }',
-            '.message-date { color: #666; font-size: 0.9em; margin-bottom: 10px; }',
-            '.message-media { margin-top: 15px; padding-top: 10px; border-top: 1px solid #eee; }',
-            '.message-media img { border-radius: 5px; margin: 5px; cursor: pointer; transition: transform 0.2s; max-width: 300px; max-height: 300px; }',
-            '.message-media img:hover { transform: scale(1.02); }',
-            '.message-media video { border-radius: 5px; margin: 5px; max-width: 400px; max-height: 400px; }',
-            '.message-media audio { margin: 5px; }',
-            '.message-media a { color: #3498db; text-decoration: none; display: inline-block; margin: 5px; padding: 8px 12px; background-color: #f8f9fa; border-radius: 4px; border: 1px solid #dee2e6; }',
-            '.message-media a:hover { text-decoration: underline; background-color: #e9ecef; }',
-            '.media-error { color: #e74c3c; font-style: italic; }',
-            '.modal { display: none; position: fixed; z-index: 1000; left: 0; top: 0; width: 100%; height: 100%; background-color: rgba(0,0,0,0.9); }',
-            '.modal-content { margin: auto; display: block; max-width: 90%; max-height: 90%; margin-top: 40px; }',
-            '.modal-content-file { margin: auto; display: block; width: 80%; height: 80%; margin-top: 40px; background-color: white; border-radius: 8px; padding: 20px; overflow: auto; }',
-            '.close { position: absolute; top: 15px; right: 35px; color: #f1f1f1; font-size: 40px; font-weight: bold; cursor: pointer; }',
-            '.close:hover, .close:focus { color: #bbb; text-decoration: none; }',
-            '.modal-caption { margin: auto; display: block; width: 80%; max-width: 700px; text-align: center; color: #ccc; padding: 10px 0; }',
-            '.modal-download { position: absolute; bottom: 20px; right: 20px; padding: 10px 15px; background-color: #4CAF50; color: white; border: none; border-radius: 4px; cursor: pointer; text-decoration: none; }',
-            '.modal-download:hover { background-color: #45a049; }',
-            '</style>',
-            '</head>',
-            '<body>',
-            '<h1>Экспорт сообщений Telegram</h1>',
-            f'<p>Всего сообщений: {len(data)}</p>'
-        ]
+        _media_file_exists.cache_clear()
+        buf = io.StringIO()
+        write = buf.write
         
-        for item in data:
-            html_parts.append(self._generate_message_html(item))
-        
-        # Добавляем модальное окно для просмотра медиа
-        html_parts.extend([
-            '<!-- Модальное окно для просмотра медиа -->',
-            '<div id="mediaModal" class="modal">',
-            '  <span class="close">&times;</span>',
-            '  <div id="modalContentContainer"></div>',
-            '  <div id="modalCaption" class="modal-caption"></div>',
-            '  <a id="modalDownload" class="modal-download" download>Скачать</a>',
-            '</div>',
-            
-            '<script>',
-            '// Получаем модальное окно',
-            'var modal = document.getElementById("mediaModal");',
-            '// Получаем элемент для закрытия модального окна',
-            'var span = document.getElementsByClassName("close")[0];',
-            '// Получаем контейнер для контента',
-            'var modalContentContainer = document.getElementById("modalContentContainer");',
-            '// Получаем элемент для подписи',
-            'var modalCaption = document.getElementById("modalCaption");',
-            '// Получаем элемент для скачивания',
-            'var modalDownload = document.getElementById("modalDownload");',
-            '',
-            '// Функция для открытия изображения',
-            'function openImage(src, caption, downloadUrl) {',
-            '  modalContentContainer.innerHTML = \'<img class="modal-content" src="\' + src + \'">\';',
-            '  modalCaption.textContent = caption;',
-            '  modalDownload.href = downloadUrl;',
-            '  modal.style.display = "block";',
-            '}',
-            '',
-            '// Функция для открытия видео',
-            'function openVideo(src, caption, downloadUrl) {',
-            '  modalContentContainer.innerHTML = \'<video class="modal-content" controls autoplay><source src="\' + src + \'">Ваш браузер не поддерживает видео тег.</video>\';',
-            '  modalCaption.textContent = caption;',
-            '  modalDownload.href = downloadUrl;',
-            '  modal.style.display = "block";',
-            '}',
-            '',
-            '// Функция для открытия аудио',
-            'function openAudio(src, caption, downloadUrl) {',
-            '  modalContentContainer.innerHTML = \'<audio class="modal-content" controls autoplay><source src="\' + src + \'">Ваш браузер не поддерживает аудио тег.</audio>\';',
-            '  modalCaption.textContent = caption;',
-            '  modalDownload.href = downloadUrl;',
-            '  modal.style.display = "block";',
-            '}',
-            '',
-            '// Функция для открытия файла',
-            'function openFile(src, caption, downloadUrl) {',
-            '  modalContentContainer.innerHTML = \'<div class="modal-content-file"><iframe src="\' + src + \'" style="width: 100%; height: 100%; border: none;"></iframe></div>\';',
-            '  modalCaption.textContent = caption;',
-            '  modalDownload.href = downloadUrl;',
-            '  modal.style.display = "block";',
-            '}',
-            '',
-            '// Когда пользователь нажимает на (x), закрываем модальное окно',
-            'span.onclick = function() {',
-            '  modal.style.display = "none";',
-            '  // Останавливаем видео/аудио при закрытии',
-            '  var mediaElements = modalContentContainer.querySelectorAll("video, audio");',
-            '  mediaElements.forEach(function(element) {',
-            '    element.pause();',
-            '    element.currentTime = 0;',
-            '  });',
-            '}',
-            '',
-            '// Когда пользователь нажимает в любом месте за пределами модального окна, закрываем его',
-            'window.onclick = function(event) {',
-            '  if (event.target == modal) {',
-            '    modal.style.display = "none";',
-            '    // Останавливаем видео/аудио при закрытии',
-            '    var mediaElements = modalContentContainer.querySelectorAll("video, audio");',
-            '    mediaElements.forEach(function(element) {',
-            '      element.pause();',
-            '      element.currentTime = 0;',
-            '    });',
-            '  }',
-            '}',
-            '</script>'
-        ])
-        
-        html_parts.extend(['</body>', '</html>'])
-        
-        return '\n'.join(html_parts)
+        write(self._HTML_HEAD)
+        write(f'<p>Всего сообщений: {len(data)}</p>\n')
+        
+        for item, sender_name, media_list in self._view_rows(data, view):
+            self._write_message_html(write, item, sender_name, media_list)
+        
+        write(self._HTML_FOOTER)
+        
+        return buf.getvalue()
     
     def _generate_message_html(self, message: Dict[str, Any]) -> str:
         """Генерирует HTML для одного сообщения."""
-        sender_info = message.get('sender_info', {})
-        sender_name = sender_info.get('title') or f"{sender_info.get('first_name', '')} {sender_info.get('last_name', '')}".strip()
+        buf = io.StringIO()
+        self._write_message_html(buf.write, message)
+        return buf.getvalue()
+    
+    def _write_message_html(
+        self,
+        write: Callable[[str], Any],
+        message: Dict[str, Any],
+        sender_name: Optional[str] = None,
+        media_list: Optional[Sequence[Dict[str, Any]]] = None
+    ) -> None:
+        """Записывает HTML одного сообщения через функцию write."""
+        if sender_name is None:
+            sender_name = self._sender_name(message.get('sender_info', {}))
+        if media_list is None:
+            media_list = self._media_list(message.get('media_info'))
         
         date_str = message.get('date', '')
         text = message.get('message', '')
+        escape = html.escape
         
-        html_parts = [
-            '<div class="message">',
-            f'<div class="message-header">{sender_name}</div>',
-            f'<div class="message-date">{date_str}</div>',
-            f'<div class="message-content">{text}</div>'
-        ]
+        write('<div class="message">\n')
+        write(f'<div class="message-header">{escape(sender_name)}</div>\n')
+        write(f'<div class="message-date">{date_str}</div>\n')
+        write(f'<div class="message-content">{escape(text) if text else ""}</div>\n')
         
         # Добавление медиафайлов
-        media_info = message.get('media_info')
-        if media_info:
-            html_parts.append('<div class="message-media">')
+        if media_list:
+            write('<div class="message-media">\n')
             
-            if isinstance(media_info, dict):
-                file_path = media_info.get('file_path')
-                media_type = media_info.get('type', 'unknown')
+            # Одиночный файл выводится без стилей, элементы альбома - с размерами и отступами
+            if isinstance(media_list, list):
+                styles, default_style = self._HTML_ALBUM_STYLES, self._HTML_ALBUM_DEFAULT_STYLE
+            else:
+                styles, default_style = {}, ''
+            
+            for media in media_list:
+                file_path = media.get('file_path')
                 
-                if file_path and Path(file_path).exists():
-                    # Создаем относительный путь от HTML файла к медиафайлу
+                if file_path and _media_file_exists(file_path):
+                    media_type = media.get('type')
+                    template = self._HTML_MEDIA_TEMPLATES.get(media_type, self._HTML_MEDIA_DEFAULT)
                     relative_path = self._get_relative_media_path(file_path)
-                    
-                    if media_type == 'photo':
-                        # Добавляем возможность открытия изображения во всплывающем окне
-                        filename = Path(file_path).name
-                        html_parts.append(f'<img src="{relative_path}" alt="Photo" onclick="openImage(\'{relative_path}\', \'{filename}\', \'{relative_path}\')" title="Нажмите для увеличения">')
-                    elif media_type == 'video':
-                        # Добавляем возможность открытия видео во всплывающем окне
-                        filename = Path(file_path).name
-                        html_parts.append(f'<video controls onclick="openVideo(\'{relative_path}\', \'{filename}\', \'{relative_path}\')" title="Нажмите для увеличения"><source src="{relative_path}" type="video/mp4">Your browser does not support the video tag.</video>')
-                    elif media_type == 'audio':
-                        # Добавляем возможность открытия аудио во всплывающем окне
-                        filename = Path(file_path).name
-                        html_parts.append(f'<audio controls onclick="openAudio(\'{relative_path}\', \'{filename}\', \'{relative_path}\')" title="Нажмите для открытия в плеере"><source src="{relative_path}" type="audio/mpeg">Your browser does not support the audio tag.</audio>')
-                    elif media_type == 'document':
-                        # Добавляем возможность открытия документа во всплывающем окне
-                        filename = Path(file_path).name
-                        html_parts.append(f'<a href="#" onclick="openFile(\'{relative_path}\', \'{filename}\', \'{relative_path}\'); return false;">📄 Открыть документ: {filename}</a>')
-                    elif media_type == 'voice':
-                        # Добавляем возможность открытия голосового сообщения во всплывающем окне
-                        filename = Path(file_path).name
-                        html_parts.append(f'<audio controls onclick="openAudio(\'{relative_path}\', \'Голосовое сообщение: {filename}\', \'{relative_path}\')" title="Нажмите для открытия в плеере"><source src="{relative_path}" type="audio/ogg">Your browser does not support the audio tag.</audio>')
-                    else:
-                        # Для других типов файлов
-                        filename = Path(file_path).name
-                        html_parts.append(f'<a href="#" onclick="openFile(\'{relative_path}\', \'{filename}\', \'{relative_path}\'); return false;">📎 Открыть файл: {filename}</a>')
+                    filename = os.path.basename(file_path)
+                    write(template.format(
+                        path=escape(relative_path),
+                        name=escape(filename),
+                        js_path=self._js_escape(relative_path),
+                        js_name=self._js_escape(filename),
+                        style=styles.get(media_type, default_style)
+                    ))
                 else:
-                    html_parts.append(f'<div class="media-error">Media file not found: {file_path}</div>')
-            elif isinstance(media_info, list):
-                # Несколько медиафайлов
-                for media in media_info:
-                    file_path = media.get('file_path')
-                    media_type = media.get('type', 'unknown')
-                    
-                    if file_path and Path(file_path).exists():
-                        relative_path = self._get_relative_media_path(file_path)
-                        
-                        if media_type == 'photo':
-                            filename = Path(file_path).name
-                            html_parts.append(f'<img src="{relative_path}" alt="Photo" onclick="openImage(\'{relative_path}\', \'{filename}\', \'{relative_path}\')" title="Нажмите для увеличения" style="max-width: 300px; max-height: 300px; margin: 5px;">')
-                        elif media_type == 'video':
-                            filename = Path(file_path).name
-                            html_parts.append(f'<video controls onclick="openVideo(\'{relative_path}\', \'{filename}\', \'{relative_path}\')" title="Нажмите для увеличения" style="max-width: 400px; max-height: 400px; margin: 5px;"><source src="{relative_path}" type="video/mp4">Your browser does not support the video tag.</video>')
-                        elif media_type == 'audio':
-                            filename = Path(file_path).name
-                            html_parts.append(f'<audio controls onclick="openAudio(\'{relative_path}\', \'{filename}\', \'{relative_path}\')" title="Нажмите для открытия в плеере" style="margin: 5px;"><source src="{relative_path}" type="audio/mpeg">Your browser does not support the audio tag.</audio>')
-                        elif media_type == 'document':
-                            filename = Path(file_path).name
-                            html_parts.append(f'<a href="#" onclick="openFile(\'{relative_path}\', \'{filename}\', \'{relative_path}\'); return false;" style="margin: 5px;">📄 Открыть документ: {filename}</a>')
-                        elif media_type == 'voice':
-                            filename = Path(file_path).name
-                            html_parts.append(f'<audio controls onclick="openAudio(\'{relative_path}\', \'Голосовое сообщение: {filename}\', \'{relative_path}\')" title="Нажмите для открытия в плеере" style="margin: 5px;"><source src="{relative_path}" type="audio/ogg">Your browser does not support the audio tag.</audio>')
-                        else:
-                            filename = Path(file_path).name
-                            html_parts.append(f'<a href="#" onclick="openFile(\'{relative_path}\', \'{filename}\', \'{relative_path}\'); return false;" style="margin: 5px;">📎 Открыть файл: {filename}</a>')
-                    else:
-                        html_parts.append(f'<div class="media-error">Media file not found: {file_path}</div>')
+                    write(f'<div class="media-error">Media file not found: {escape(str(file_path))}</div>\n')
             
-            html_parts.append('</div>')
-        
-        html_parts.append('</div>')
+            write('</div>\n')
         
-        return '\n'.join(html_parts)
+        write('</div>\n')
+    
+    @staticmethod
+    def _js_escape(value: str) -> str:
+        """Экранирует значение для строкового литерала JS внутри HTML атрибута."""
+        return html.escape(value.replace('\\', '\\\\').replace("'", "\\'"))
     
     def _get_relative_media_path(self, file_path: str) -> str:
         """Создает относительный путь от HTML файла к медиафайлу."""
-        file_path = Path(file_path)
-        
-        # Если файл находится в downloads/media/*, создаем относительный путь
-        if 'downloads' in file_path.parts and 'media' in file_path.parts:
-            # Находим индекс 'media' в пути
-            parts = file_path.parts
-            try:
-                media_index = parts.index('media')
-                # Берем путь от 'media' включительно
-                relative_parts = parts[media_index:]
-                return '/'.join(relative_parts)
-            except ValueError:
-                # Если 'media' не найдено, используем только имя файла
-                return file_path.name
-        else:
-            # Для других случаев используем только имя файла
-            return file_path.name
+        return _relative_media_path(str(file_path))
     
-    def _generate_markdown(self, data: List[Dict[str, Any]]) -> str:
+    def _generate_markdown(self, data: List[Dict[str, Any]], view: Optional[Dict[str, List[Any]]] = None) -> str:
         """Генерирует Markdown контент."""
+        _media_file_exists.cache_clear()
         md_parts = [
             "# Экспорт сообщений Telegram",
             "",
@@ -413,16 +671,27 @@ class ExportManager:
             ""
         ]
         
-        for item in data:
-            md_parts.append(self._generate_message_markdown(item))
+        for item, sender_name, media_list in self._view_rows(data, view):
+            md_parts.append('\n'.join(self._iter_message_markdown(item, sender_name, media_list)))
             md_parts.append("")
         
         return '\n'.join(md_parts)
     
     def _generate_message_markdown(self, message: Dict[str, Any]) -> str:
         """Генерирует Markdown для одного сообщения."""
-        sender_info = message.get('sender_info', {})
-        sender_name = sender_info.get('title') or f"{sender_info.get('first_name', '')} {sender_info.get('last_name', '')}".strip()
+        return '\n'.join(self._iter_message_markdown(message))
+    
+    def _iter_message_markdown(
+        self,
+        message: Dict[str, Any],
+        sender_name: Optional[str] = None,
+        media_list: Optional[Sequence[Dict[str, Any]]] = None
+    ) -> Iterator[str]:
+        """Построчно выдает Markdown для одного сообщения."""
+        if sender_name is None:
+            sender_name = self._sender_name(message.get('sender_info', {}))
+        if media_list is None:
+            media_list = self._media_list(message.get('media_info'))
         
         date_str = message.get('date', '')
         text = message.get('message', '')
@@ -440,22 +709,19 @@ class ExportManager:
         else:
             id_line = f"`ID: {message_id}`"
         
-        md_parts = [
-            f"**{sender_name}**",
-            f"*{date_str}*",
-            id_line,
-            ""
-        ]
+        yield f"**{sender_name}**"
+        yield f"*{date_str}*"
+        yield id_line
+        yield ""
         
         # Добавление цитаты (reply)
         if reply_to:
             reply_msg = reply_to.get('message', {})
             if reply_msg:
-                reply_sender = reply_msg.get('sender_info', {})
-                reply_sender_name = reply_sender.get('title') or f"{reply_sender.get('first_name', '')} {reply_sender.get('last_name', '')}".strip()
+                reply_sender_name = self._sender_name(reply_msg.get('sender_info', {}))
                 reply_text = reply_msg.get('message', '')
-                md_parts.append(f"> **{reply_sender_name}:** {reply_text}")
-                md_parts.append("")
+                yield f"> **{reply_sender_name}:** {reply_text}"
+                yield ""
         
         # Добавление пересылки (forward)
         forward = message.get('fwd_from', {})
@@ -478,71 +744,40 @@ class ExportManager:
             forward_date = forward.get('date', '')
             if forward_date:
                 forward_date_str = forward_date.strftime('%Y-%m-%d %H:%M:%S')
-                md_parts.append(f"*Переслано от {forward_sender_name} {forward_date_str}*")
-                md_parts.append("")
+                yield f"*Переслано от {forward_sender_name} {forward_date_str}*"
+                yield ""
         
         # Добавление текста сообщения
         if text:
-            md_parts.append(text)
-            md_parts.append("")
+            yield text
+            yield ""
         
         # Добавление медиафайлов
-        media_info = message.get('media_info')
-        if media_info:
-            md_parts.append("**Медиафайлы:**")
+        if media_list:
+            yield "**Медиафайлы:**"
             
-            if isinstance(media_info, dict):
-                file_path = media_info.get('file_path')
-                media_type = media_info.get('type', 'unknown')
-                file_name = Path(file_path).name if file_path else "Неизвестно"
-                
-                if file_path and Path(file_path).exists():
-                    relative_path = self._get_relative_media_path(file_path)
-                    
-                    if media_type == 'photo':
-                        md_parts.append(f"![Фото]({relative_path})")
-                    elif media_type == 'video':
-                        md_parts.append(f"[Видео]({relative_path})")
-                    elif media_type == 'audio':
-                        md_parts.append(f"[Аудио]({relative_path})")
-                    elif media_type == 'document':
-                        md_parts.append(f"[Документ]({relative_path})")
-                    elif media_type == 'voice':
-                        md_parts.append(f"[Голосовое сообщение]({relative_path})")
-                    else:
-                        md_parts.append(f"[Файл]({relative_path})")
-                else:
-                    md_parts.append(f"Файл не найден: {file_name}")
-            elif isinstance(media_info, list):
-                for media in media_info:
-                    file_path = media.get('file_path')
-                    media_type = media.get('type', 'unknown')
-                    file_name = Path(file_path).name if file_path else "Неизвестно"
-                    
-                    if file_path and Path(file_path).exists():
-                        relative_path = self._get_relative_media_path(file_path)
-                        
-                        if media_type == 'photo':
-                            md_parts.append(f"![Фото]({relative_path})")
-                        elif media_type == 'video':
-                            md_parts.append(f"[Видео]({relative_path})")
-                        elif media_type == 'audio':
-                            md_parts.append(f"[Аудио]({relative_path})")
-                        elif media_type == 'document':
-                            md_parts.append(f"[Документ]({relative_path})")
-                        elif media_type == 'voice':
-                            md_parts.append(f"[Голосовое сообщение]({relative_path})")
-                        else:
-                            md_parts.append(f"[Файл]({relative_path})")
-                    else:
-                        md_parts.append(f"Файл не найден: {file_name}")
+            for media in media_list:
+                yield self._render_media_markdown(media)
             
-            md_parts.append("")
+            yield ""
+    
+    def _render_media_markdown(self, media: Dict[str, Any]) -> str:
+        """Формирует строку Markdown для одного медиафайла."""
+        file_path = media.get('file_path')
         
-        return '\n'.join(md_parts)
+        if file_path and _media_file_exists(file_path):
+            label = self._MD_MEDIA_LABELS.get(media.get('type'), '[Файл]')
+            return f"{label}({self._get_relative_media_path(file_path)})"
+        
+        file_name = os.path.basename(file_path) if file_path else "Неизвестно"
+        return f"Файл не найден: {file_name}"
     
     def _dict_to_xml(self, parent: ET.Element, data: Dict[str, Any]) -> None:
         """Преобразует словарь в XML элементы."""
+        if _fast_dict_to_xml is not None and type(data) is dict:
+            _fast_dict_to_xml(parent, data)
+            return
+        
         for key, value in data.items():
             if isinstance(value, dict):
                 child = ET.SubElement(parent, key)
@@ -567,23 +802,41 @@ class ExportManager:
         """Экспортирует данные в несколько форматов."""
         results = {}
         
+        # CSV и Excel используют одни и те же плоские записи - разворачиваем их один раз
+        flat_data = None
+        if 'csv' in formats or 'excel' in formats:
+            flat_data = self._flatten_rows(data)
+        
+        # Имена отправителей и медиафайлы HTML и Markdown тоже извлекаются один раз
+        view = None
+        if {'html', 'markdown', 'md'} & set(formats):
+            view = self._prepare_view(data)
+        
+        # Одна метка времени на все файлы пакета: имена отличаются только расширением
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        
         format_handlers = {
-            'json': self.export_json,
-            'jsonl': self.export_jsonl,
-            'csv': self.export_csv,
-            'excel': self.export_excel,
-            'html': self.export_html,
-            'xml': self.export_xml,
-            'markdown': self.export_markdown,
-            'md': self.export_markdown
+            'json': partial(self.export_json, timestamp=timestamp),
+            'jsonl': partial(self.export_jsonl, timestamp=timestamp),
+            'csv': lambda _, name: self._export_csv_flat(flat_data, name, timestamp),
+            'excel': lambda _, name: self._export_excel_flat(flat_data, name, timestamp),
+            'html': partial(self.export_html, view=view, timestamp=timestamp),
+            'xml': partial(self.export_xml, timestamp=timestamp),
+            'markdown': partial(self.export_markdown, view=view, timestamp=timestamp),
+            'md': partial(self.export_markdown, view=view, timestamp=timestamp)
         }
         
-        for fmt in formats:
-            if fmt in format_handlers:
-                try:
-                    filepath = await format_handlers[fmt](data, base_filename)
-                    results[fmt] = filepath
-                except Exception as e:
-                    results[fmt] = f"Ошибка: {str(e)}"
+        # Форматы не зависят друг от друга, поэтому экспортируются одновременно
+        selected = [fmt for fmt in dict.fromkeys(formats) if fmt in format_handlers]
+        outcomes = await asyncio.gather(
+            *(format_handlers[fmt](data, base_filename) for fmt in selected),
+            return_exceptions=True
+        )
+        
+        for fmt, outcome in zip(selected, outcomes):
+            if isinstance(outcome, Exception):
+                results[fmt] = f"Ошибка: {str(outcome)}"
+            else:
+                results[fmt] = outcome
         
-        return results
\ No newline at end of file
+        return results
@@ -4,13 +4,12 @@
 """
 
 import os
-import aiofiles
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple, Callable
 import asyncio
 from datetime import datetime
-import mimetypes
 import hashlib
+import threading
 from telethon.tl.types import (
     MessageMediaPhoto, MessageMediaDocument, MessageMediaContact,
     MessageMediaGeo, MessageMediaVenue, MessageMediaGame,
@@ -19,12 +18,74 @@ from telethon.tl.types import (
 )
 import logging
 
+# Алгоритм file_hash; один для всех установок, чтобы хэши можно было сравнивать
+HASH_ALGORITHM = 'sha256'
+
+# Расширения по умолчанию для типов медиа
+DEFAULT_EXTENSIONS = {
+    'photo': '.jpg',
+    'video': '.mp4',
+    'audio': '.mp3',
+    'voice': '.ogg',
+    'sticker': '.webp',
+    'document': '.bin'
+}
+
+# Расширения для MIME типов, которые встречаются в Telegram
+MIME_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/heic': '.heic',
+    'image/bmp': '.bmp',
+    'image/svg+xml': '.svg',
+    'video/mp4': '.mp4',
+    'video/quicktime': '.mov',
+    'video/webm': '.webm',
+    'video/x-matroska': '.mkv',
+    'video/x-msvideo': '.avi',
+    'video/mpeg': '.mpeg',
+    'video/3gpp': '.3gp',
+    'audio/mpeg': '.mp3',
+    'audio/mp3': '.mp3',
+    'audio/ogg': '.ogg',
+    'audio/opus': '.opus',
+    'audio/mp4': '.m4a',
+    'audio/x-m4a': '.m4a',
+    'audio/aac': '.aac',
+    'audio/flac': '.flac',
+    'audio/x-flac': '.flac',
+    'audio/wav': '.wav',
+    'audio/x-wav': '.wav',
+    'application/pdf': '.pdf',
+    'application/zip': '.zip',
+    'application/x-rar-compressed': '.rar',
+    'application/vnd.rar': '.rar',
+    'application/x-7z-compressed': '.7z',
+    'application/x-tgsticker': '.tgs',
+    'application/json': '.json',
+    'application/msword': '.doc',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+    'application/vnd.ms-excel': '.xls',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
+    'application/vnd.ms-powerpoint': '.ppt',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
+    'application/vnd.android.package-archive': '.apk',
+    'text/plain': '.txt',
+    'text/csv': '.csv',
+    'text/html': '.html',
+}
+
 class MediaDownloader:
     """Скачивание медиафайлов из сообщений Telegram."""
     
+    # Директории, уже созданные в этом процессе (общие для всех экземпляров)
+    _initialized_dirs = set()
+    _dirs_lock = threading.Lock()
+    
     def __init__(self, download_dir: str = "downloads/media"):
         self.download_dir = Path(download_dir)
-        self.download_dir.mkdir(parents=True, exist_ok=True)
         self.logger = logging.getLogger('telegram_downloader.media')
         
         # Поддиректории для разных типов медиа
@@ -39,8 +100,19 @@ class MediaDownloader:
             'location': self.download_dir / 'locations'
         }
         
-        for subdir in self.subdirs.values():
-            subdir.mkdir(exist_ok=True)
+        self._ensure_dirs()
+    
+    def _ensure_dirs(self) -> None:
+        """Создает директории для медиа, пропуская уже созданные ранее."""
+        with self._dirs_lock:
+            if self.download_dir not in self._initialized_dirs:
+                self.download_dir.mkdir(parents=True, exist_ok=True)
+                self._initialized_dirs.add(self.download_dir)
+            
+            for subdir in self.subdirs.values():
+                if subdir not in self._initialized_dirs:
+                    subdir.mkdir(exist_ok=True)
+                    self._initialized_dirs.add(subdir)
     
     def _generate_filename(
         self,
@@ -67,28 +139,24 @@ class MediaDownloader:
     
     def _get_default_extension(self, media_type: str) -> str:
         """Возвращает расширение по умолчанию для типа медиа."""
-        extensions = {
-            'photo': '.jpg',
-            'video': '.mp4',
-            'audio': '.mp3',
-            'voice': '.ogg',
-            'sticker': '.webp',
-            'document': '.bin'
-        }
-        return extensions.get(media_type, '.bin')
+        return DEFAULT_EXTENSIONS.get(media_type, '.bin')
     
     def _get_file_extension_from_mime(self, mime_type: str) -> str:
         """Определяет расширение по MIME типу."""
-        extension = mimetypes.guess_extension(mime_type)
-        return extension or '.bin'
+        return MIME_EXTENSIONS.get(mime_type, '.bin')
     
     async def download_media(
         self,
         message,
         chat_id: int,
-        progress_callback: Optional[Callable] = None
+        progress_callback: Optional[Callable] = None,
+        compute_hash: bool = False
     ) -> Optional[Dict[str, Any]]:
-        """Скачивает медиафайл из сообщения."""
+        """Скачивает медиафайл из сообщения.
+        
+        Для уже скачанного файла хэш вычисляется только при compute_hash=True,
+        иначе file_hash равен None (файл не перечитывается при каждом проходе).
+        """
         try:
             if not message.media:
                 return None
@@ -108,13 +176,19 @@ class MediaDownloader:
             file_path = save_dir / filename
             
             # Проверка существующего файла
-            if file_path.exists():
-                file_hash = await self._calculate_file_hash(file_path)
+            try:
+                file_stat = file_path.stat()
+            except FileNotFoundError:
+                file_stat = None
+            
+            if file_stat is not None:
+                file_hash = await self._calculate_file_hash(file_path) if compute_hash else None
                 return {
                     'type': media_info['type'],
                     'file_path': str(file_path),
-                    'file_size': file_path.stat().st_size,
+                    'file_size': file_stat.st_size,
                     'file_hash': file_hash,
+                    'hash_algorithm': HASH_ALGORITHM if file_hash else None,
                     'downloaded': False,
                     'reason': 'already_exists'
                 }
@@ -134,6 +208,7 @@ class MediaDownloader:
                     'file_path': str(file_path),
                     'file_size': file_path.stat().st_size,
                     'file_hash': file_hash,
+                    'hash_algorithm': HASH_ALGORITHM,
                     'downloaded': True,
                     'metadata': media_info.get('metadata', {})
                 }
@@ -162,61 +237,53 @@ class MediaDownloader:
             document = media.document
             mime_type = document.mime_type
             
-            # Определение типа по MIME
-            if mime_type.startswith('image/'):
-                media_type = 'photo'
-            elif mime_type.startswith('video/'):
-                media_type = 'video'
-            elif mime_type.startswith('audio/'):
-                if 'voice' in mime_type or document.attributes:
-                    for attr in document.attributes:
-                        if isinstance(attr, DocumentAttributeAudio) and attr.voice:
-                            media_type = 'voice'
-                            break
-                    else:
-                        media_type = 'audio'
-                else:
-                    media_type = 'audio'
-            elif mime_type.startswith('application/'):
-                media_type = 'document'
-            else:
-                media_type = 'document'
-            
-            # Извлечение имени файла
-            filename = None
-            for attr in document.attributes:
-                if isinstance(attr, DocumentAttributeFilename):
-                    filename = attr.file_name
-                    break
-            
-            extension = self._get_file_extension_from_mime(mime_type)
-            
             metadata = {
                 'mime_type': mime_type,
                 'size': document.size,
                 'date': document.date
             }
             
-            # Дополнительная информация для видео
+            # Имя файла, признак голосового сообщения и метаданные собираются за один проход
+            # (атрибуты telethon - конкретные классы, поэтому достаточно сравнения type)
+            filename = None
+            is_voice = False
             for attr in document.attributes:
-                if isinstance(attr, DocumentAttributeVideo):
+                attr_type = type(attr)
+                if attr_type is DocumentAttributeFilename:
+                    if filename is None:
+                        filename = attr.file_name
+                elif attr_type is DocumentAttributeVideo:
+                    # Дополнительная информация для видео
                     metadata.update({
                         'duration': attr.duration,
                         'width': attr.w,
                         'height': attr.h
                     })
-                elif isinstance(attr, DocumentAttributeAudio):
+                elif attr_type is DocumentAttributeAudio:
+                    is_voice = is_voice or bool(attr.voice)
                     metadata.update({
                         'duration': attr.duration,
                         'title': attr.title,
                         'performer': attr.performer
                     })
-                elif isinstance(attr, DocumentAttributeImageSize):
+                elif attr_type is DocumentAttributeImageSize:
                     metadata.update({
                         'width': attr.w,
                         'height': attr.h
                     })
             
+            # Определение типа по MIME
+            if mime_type.startswith('image/'):
+                media_type = 'photo'
+            elif mime_type.startswith('video/'):
+                media_type = 'video'
+            elif mime_type.startswith('audio/'):
+                media_type = 'voice' if is_voice else 'audio'
+            else:
+                media_type = 'document'
+            
+            extension = self._get_file_extension_from_mime(mime_type)
+            
             return {
                 'type': media_type,
                 'filename': filename,
@@ -247,37 +314,55 @@ class MediaDownloader:
         return None
     
     async def _calculate_file_hash(self, file_path: Path) -> str:
-        """Вычисляет MD5 хэш файла."""
-        hash_md5 = hashlib.md5()
-        async with aiofiles.open(file_path, 'rb') as f:
-            async for chunk in self._read_file_chunks(f):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        """Вычисляет хэш файла (HASH_ALGORITHM)."""
+        # Весь файл читается в одном переходе в поток, а не отдельным await на каждую часть
+        return await asyncio.to_thread(self._hash_file_sync, file_path)
     
-    async def _read_file_chunks(self, file, chunk_size: int = 8192):
-        """Читает файл по частям."""
-        while True:
-            chunk = await file.read(chunk_size)
-            if not chunk:
-                break
-            yield chunk
+    def _hash_file_sync(self, file_path: Path, chunk_size: int = 1024 * 1024) -> str:
+        """Синхронно вычисляет хэш файла."""
+        with open(file_path, 'rb') as f:
+            if hasattr(hashlib, 'file_digest'):
+                return hashlib.file_digest(f, HASH_ALGORITHM).hexdigest()
+            
+            hasher = hashlib.new(HASH_ALGORITHM)
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                hasher.update(chunk)
+            return hasher.hexdigest()
     
     async def download_batch(
         self,
         messages: List[Any],
         chat_id: int,
-        max_concurrent: int = 3
+        max_concurrent: int = 3,
+        semaphore: Optional[asyncio.Semaphore] = None
     ) -> List[Dict[str, Any]]:
-        """Скачивает медиафайлы из пакета сообщений."""
-        semaphore = asyncio.Semaphore(max_concurrent)
+        """
+        Скачивает медиафайлы из пакета сообщений.
+        
+        Общий semaphore ограничивает число загрузок сразу для нескольких
+        пакетов, обрабатываемых одновременно.
+        """
         results = []
+        media_messages = [msg for msg in messages if msg.media]
+        downloaded = [None] * len(media_messages)
+        
+        # Фиксированное число воркеров разбирает общий итератор; порядок результатов сохраняется
+        pending = iter(enumerate(media_messages))
         
-        async def download_with_semaphore(message):
+        async def download(message):
+            if semaphore is None:
+                return await self.download_media(message, chat_id)
             async with semaphore:
                 return await self.download_media(message, chat_id)
         
-        tasks = [download_with_semaphore(msg) for msg in messages if msg.media]
-        downloaded = await asyncio.gather(*tasks, return_exceptions=True)
+        async def worker():
+            for index, message in pending:
+                try:
+                    downloaded[index] = await download(message)
+                except Exception as e:
+                    downloaded[index] = e
+        
+        await asyncio.gather(*(worker() for _ in range(min(max_concurrent, len(media_messages)))))
         
         for result in downloaded:
             if isinstance(result, dict):
@@ -296,40 +381,55 @@ class MediaDownloader:
         }
         
         for media_type, subdir in self.subdirs.items():
-            if subdir.exists():
-                files = list(subdir.iterdir())
-                total_size = sum(f.stat().st_size for f in files if f.is_file())
-                
-                stats['by_type'][media_type] = {
-                    'count': len(files),
-                    'size': total_size
-                }
-                stats['total_files'] += len(files)
-                stats['total_size'] += total_size
+            # os.scandir отдает тип и stat из записей каталога без отдельных системных вызовов
+            try:
+                with os.scandir(subdir) as entries:
+                    sizes = [entry.stat().st_size for entry in entries if entry.is_file(follow_symlinks=False)]
+            except FileNotFoundError:
+                continue
+            
+            total_size = sum(sizes)
+            
+            stats['by_type'][media_type] = {
+                'count': len(sizes),
+                'size': total_size
+            }
+            stats['total_files'] += len(sizes)
+            stats['total_size'] += total_size
         
         return stats
     
     async def cleanup_duplicates(self) -> Dict[str, int]:
         """Удаляет дубликаты медиафайлов по хэшу."""
         removed_count = 0
-        hash_map = {}
         
+        # Дубликатами могут быть только файлы одного размера, поэтому
+        # сначала файлы группируются по размеру (stat берется из DirEntry)
+        size_map: Dict[int, List[str]] = {}
         for subdir in self.subdirs.values():
-            if not subdir.exists():
+            try:
+                with os.scandir(subdir) as entries:
+                    for entry in entries:
+                        if entry.is_file(follow_symlinks=False):
+                            size_map.setdefault(entry.stat().st_size, []).append(entry.path)
+            except FileNotFoundError:
+                continue
+        
+        # Хэшируются только группы с совпадающими размерами
+        for paths in size_map.values():
+            if len(paths) < 2:
                 continue
             
-            for file_path in subdir.iterdir():
-                if not file_path.is_file():
-                    continue
-                
-                file_hash = await self._calculate_file_hash(file_path)
-                
-                if file_hash in hash_map:
+            hashes = await asyncio.gather(*(self._calculate_file_hash(path) for path in paths))
+            
+            seen_hashes = set()
+            for file_path, file_hash in zip(paths, hashes):
+                if file_hash in seen_hashes:
                     # Найден дубликат
-                    file_path.unlink()
+                    os.unlink(file_path)
                     removed_count += 1
-                    self.logger.info(f"Удален дубликат: {file_path.name}")
+                    self.logger.info(f"Удален дубликат: {os.path.basename(file_path)}")
                 else:
-                    hash_map[file_hash] = str(file_path)
+                    seen_hashes.add(file_hash)
         
         return {'removed_duplicates': removed_count}
\ No newline at end of file
@@ -3,11 +3,11 @@
 Сохраняет прогресс и позволяет продолжить скачивание с места остановки.
 """
 
-import json
+import asyncio
+import orjson
 import os
 from pathlib import Path
 from typing import Dict, Any, Optional
-import aiofiles
 from datetime import datetime
 
 class ResumeManager:
@@ -16,6 +16,8 @@ class ResumeManager:
     def __init__(self, resume_dir: str = "resume_data"):
         self.resume_dir = Path(resume_dir)
         self.resume_dir.mkdir(exist_ok=True)
+        # Прогресс, уже прочитанный или записанный в этом процессе (None - файла нет)
+        self._cache: Dict[int, Optional[Dict[str, Any]]] = {}
     
     def _get_resume_file(self, chat_id: int) -> Path:
         """Возвращает путь к файлу прогресса для чата."""
@@ -39,20 +41,26 @@ class ResumeManager:
         }
         
         resume_file = self._get_resume_file(chat_id)
-        async with aiofiles.open(resume_file, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(resume_data, indent=2, ensure_ascii=False))
+        content = orjson.dumps(resume_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        await asyncio.to_thread(resume_file.write_bytes, content)
+        self._cache[chat_id] = resume_data
     
     async def load_progress(self, chat_id: int) -> Optional[Dict[str, Any]]:
         """Загружает сохраненный прогресс для чата."""
+        if chat_id in self._cache:
+            return self._cache[chat_id]
+        
         resume_file = self._get_resume_file(chat_id)
         
         if not resume_file.exists():
+            self._cache[chat_id] = None
             return None
         
         try:
-            async with aiofiles.open(resume_file, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                return json.loads(content)
+            content = await asyncio.to_thread(resume_file.read_bytes)
+            progress = orjson.loads(content)
+            self._cache[chat_id] = progress
+            return progress
         except Exception as e:
             print(f"Ошибка загрузки прогресса: {e}")
             return None
@@ -62,6 +70,7 @@ class ResumeManager:
         resume_file = self._get_resume_file(chat_id)
         if resume_file.exists():
             resume_file.unlink()
+        self._cache[chat_id] = None
     
     async def get_resume_info(self, chat_id: int) -> Optional[Dict[str, Any]]:
         """Возвращает информацию о возможности возобновления."""
@@ -81,13 +90,12 @@ class ResumeManager:
         incomplete = []
         for file in self.resume_dir.glob("resume_*.json"):
             try:
-                with open(file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    incomplete.append({
-                        "chat_id": data["chat_id"],
-                        "total_downloaded": data["total_downloaded"],
-                        "timestamp": data["timestamp"]
-                    })
+                data = orjson.loads(file.read_bytes())
+                incomplete.append({
+                    "chat_id": data["chat_id"],
+                    "total_downloaded": data["total_downloaded"],
+                    "timestamp": data["timestamp"]
+                })
             except:
                 continue
         return incomplete
@@ -98,10 +106,3 @@ class ResumeManager:
         if progress and "last_message_id" in progress:
             return progress["last_message_id"]
         return None
-    
-    async def check_resume_point(self, chat_id: int) -> Optional[int]:
-        """Проверяет точку возобновления для чата."""
-        progress = await self.load_progress(chat_id)
-        if progress and "last_message_id" in progress:
-            return progress["last_message_id"]
-        return None
\ No newline at end of file
@@ -2,13 +2,14 @@ from telethon.tl.functions.messages import GetDialogsRequest
 from telethon.tl.functions.messages import GetHistoryRequest
 from telethon.tl.types import InputPeerEmpty
 from auth_info import client, bot_token
-from bot_send_message import sent_msg2bot, bot_name
+from bot_send_message import sent_msg2bot, get_bot_name
+import asyncio
 import re
-import time
-from itertools import compress
+from functools import lru_cache
 import json
+import orjson
 import os
-import datetime
+from collections import deque
 
 # Start client and get user ID
 print("Starting Telegram client...")
@@ -28,109 +29,196 @@ monitoring_channels = [
 key_words = ["бот", "bot", "школа", "работа"]
 blocked_ids = [ 875512659, 1308930532, ]
 
+# sets for O(1) membership checks in the polling loop
+monitoring_channels = frozenset(monitoring_channels)
+blocked_ids = frozenset(blocked_ids)
+
 # set time pause for refreshing requests (in seconds)
 time_pause = 60
 
 # set limit of messages amount
 limit_msg = 10
 
+# set number of last forwarded message ids remembered to avoid duplicates
+max_seen_msg = 500
+
+
+# whitespace runs are collapsed to a single space in key words and messages
+WHITESPACE_RE = re.compile(r"\s+")
+
+# preprocess key words once; a tuple is also the cache key of the compiled key word pattern
+key_words = tuple(WHITESPACE_RE.sub(" ", x.lower()) for x in key_words)
 
-# preprocess key words
-key_words = [x.lower() for x in key_words]
-key_words = [re.sub(r"\s+", " ", x) for x in key_words]
+
+@lru_cache(maxsize=None)
+def keyword_pattern(kw):
+    # one alternation for all key words; the lookahead makes findall report
+    # a match at every position, so overlapping key words are not missed
+    alternation = "|".join(re.escape(s) for s in sorted(kw, key=len, reverse=True))
+    return re.compile(f"(?=({alternation}))")
 
 
 def check_key_msg(msg, kw):
     # function for checking if message contains at least one of the key words
-    msg = msg.lower()
-    msg = re.sub(r"\s+", " ", msg).strip(" ")
+    msg = WHITESPACE_RE.sub(" ", msg.lower()).strip(" ")
 
-    return any(s in msg for s in kw), ", ".join(
-        list(compress(kw, [s in msg for s in kw]))
-    )
+    found = set(keyword_pattern(tuple(kw)).findall(msg))
+    # a shorter key word starting at the same position as a longer one is part of that match
+    matched = [s for s in kw if s in found or any(s in f for f in found)]
+    return bool(matched), ", ".join(matched)
 
 
-def notify_user(key_word, channel_name, msg_id, chat_id, user_id):
+async def notify_user(key_word, channel_name, msg_id, chat_id, user_id):
     # function for forwarding message from channel to telegram bot and sending message from bot to the user
-    sent_msg2bot(f"key words: {key_word}, channel name: {channel_name}", user_id)
-    client.forward_messages(bot_name, msg_id, chat_id)
+    # wait for the notice, so it arrives before the forwarded message
+    await asyncio.wrap_future(sent_msg2bot(f"key words: {key_word}, channel name: {channel_name}", user_id))
+    await client.forward_messages(get_bot_name(), msg_id, chat_id)
+
+
+def fetch_history(channel_entity, min_id):
+    # request for the last messages of the channel that are newer than min_id
+    return client(
+        GetHistoryRequest(
+            peer=channel_entity,
+            limit=limit_msg,
+            offset_date=None,
+            offset_id=0,
+            max_id=0,
+            min_id=min_id,
+            add_offset=0,
+            hash=0,
+        )
+    )
 
 
-def main():
-    all_msg_file = "all_msg.json"
-    if os.path.exists(all_msg_file):
+def load_seen_ids(log_file, legacy_file):
+    # function for loading forwarded message ids: one id per line in the log,
+    # or the JSON list written by earlier versions if there is no log yet
+    if os.path.exists(log_file):
+        all_msg = []
+        try:
+            with open(log_file, "r") as f:
+                for line in f:
+                    try:
+                        all_msg.append(int(line))
+                    except ValueError:
+                        pass  # a line cut short by a crash
+        except Exception as e:
+            print(f"Warning: Could not load {log_file} due to {e}. Starting with an empty list.")
+        return all_msg
+
+    if os.path.exists(legacy_file):
         try:
-            with open(all_msg_file, "r") as f:
+            with open(legacy_file, "r") as f:
                 all_msg = json.load(f)
             if not isinstance(all_msg, list): # Ensure it's a list
-                print("Warning: all_msg.json did not contain a valid list. Starting with an empty list.")
+                print(f"Warning: {legacy_file} did not contain a valid list. Starting with an empty list.")
                 all_msg = []
         except json.JSONDecodeError:
-            print(f"Warning: Could not decode JSON from {all_msg_file}. Starting with an empty list.")
+            print(f"Warning: Could not decode JSON from {legacy_file}. Starting with an empty list.")
             all_msg = []
         except Exception as e:
-            print(f"Warning: Could not load {all_msg_file} due to {e}. Starting with an empty list.")
+            print(f"Warning: Could not load {legacy_file} due to {e}. Starting with an empty list.")
             all_msg = []
-    else:
-        all_msg = []
+        return all_msg
+
+    return []
+
+
+async def main():
+    all_msg_file = "all_msg.log"
+    all_msg = load_seen_ids(all_msg_file, "all_msg.json")
+
+    # the last max_seen_msg ids are kept in order; the set gives O(1) membership checks
+    all_msg = deque(all_msg, maxlen=max_seen_msg)
+    all_msg_set = set(all_msg)
+
+    # compact the log to the remembered ids, then append each new id as it is forwarded,
+    # so nothing is lost if the process is killed
+    with open(all_msg_file, "w") as f:
+        f.writelines(f"{mid}\n" for mid in all_msg)
+    all_msg_log = open(all_msg_file, "a")
     
+    # channel entities do not change, so each one is resolved only once
+    entity_cache = {}
+    # newest message id fetched per channel; later polls ask the server only for newer ones
+    last_seen_id = {}
+
     try:
         while True:
+            # resolve the entities that are not cached yet
+            channels = []
             for target_group in groups:
-                if target_group.title in monitoring_channels:
+                channel_entity = entity_cache.get(target_group.title)
+                if channel_entity is None:
                     try:
-                        channel_entity = client.get_entity(target_group.title)
-                        posts = client(
-                            GetHistoryRequest(
-                                peer=channel_entity,
-                                limit=limit_msg,
-                                offset_date=None,
-                                offset_id=0,
-                                max_id=0,
-                                min_id=0,
-                                add_offset=0,
-                                hash=0,
-                            )
-                        )
-
-                        post_msg = posts.messages
-
-                        for m in post_msg:
-                            if hasattr(m, 'message') and m.message:
-                                print(f"User id: {m.from_id.user_id}")
-                                print(f"Сообщение: {m.message[:200]}")
-                                is_keyword_present, keywords_found = check_key_msg(m.message, key_words)
-                                if is_keyword_present and m.id not in all_msg and m.from_id.user_id not in blocked_ids:
-                                    # send message to user with key words and message
-                                    notify_user(
-                                        keywords_found,
-                                        target_group.title,
-                                        m.id,
-                                        target_group.id,
-                                        client_user_id
-                                    )
-                                    all_msg.append(m.id)
-                            else:
-                                pass
-
-                        all_msg = all_msg[-500:]
-
+                        channel_entity = await client.get_entity(target_group.title)
                     except ValueError as e:
                         print(f"Could not find entity for '{target_group.title}': {e}")
                         continue
                     except Exception as e:
                         print(f"An error occurred processing '{target_group.title}': {e}")
-                        time.sleep(10)
+                        await asyncio.sleep(10)
+                        continue
+                    entity_cache[target_group.title] = channel_entity
+                channels.append((target_group, channel_entity))
 
-            time.sleep(time_pause)
+            # request the history of all channels at once, so a cycle waits for the slowest
+            # channel instead of the sum of all of them; results are handled in channel order
+            histories = await asyncio.gather(
+                *(
+                    fetch_history(channel_entity, last_seen_id.get(channel_entity.id, 0))
+                    for _, channel_entity in channels
+                ),
+                return_exceptions=True,
+            )
+
+            for (target_group, channel_entity), posts in zip(channels, histories):
+                try:
+                    if isinstance(posts, Exception):
+                        raise posts
+
+                    # the server returns the newest messages first; handle them oldest first and
+                    # move the cursor past each one only after it is handled, so an error leaves
+                    # the remaining messages for the next poll
+                    for m in sorted(posts.messages, key=lambda m: m.id):
+                        if hasattr(m, 'message') and m.message:
+                            # channel posts and anonymous admins have no user in from_id
+                            sender_id = getattr(m.from_id, 'user_id', None)
+                            print(f"User id: {sender_id}")
+                            print(f"Сообщение: {m.message[:200]}")
+                            is_keyword_present, keywords_found = check_key_msg(m.message, key_words)
+                            if is_keyword_present and m.id not in all_msg_set and sender_id not in blocked_ids:
+                                # send message to user with key words and message
+                                await notify_user(
+                                    keywords_found,
+                                    target_group.title,
+                                    m.id,
+                                    target_group.id,
+                                    client_user_id
+                                )
+                                if len(all_msg) == max_seen_msg:
+                                    all_msg_set.discard(all_msg[0])
+                                all_msg.append(m.id)
+                                all_msg_set.add(m.id)
+                                all_msg_log.write(f"{m.id}\n")
+                                all_msg_log.flush()
+                        else:
+                            pass
+
+                        last_seen_id[channel_entity.id] = max(last_seen_id.get(channel_entity.id, 0), m.id)
+
+                except ValueError as e:
+                    print(f"Could not find entity for '{target_group.title}': {e}")
+                    continue
+                except Exception as e:
+                    print(f"An error occurred processing '{target_group.title}': {e}")
+                    await asyncio.sleep(10)
+
+            await asyncio.sleep(time_pause)
     finally:
-        print("Saving all_msg to file...")
-        try:
-            with open(all_msg_file, "w") as f:
-                json.dump(all_msg, f)
-            print(f"Successfully saved {len(all_msg)} message IDs to {all_msg_file}")
-        except Exception as e:
-            print(f"Error saving all_msg to {all_msg_file}: {e}")
+        all_msg_log.close()
+        print(f"Saved {len(all_msg)} message IDs in {all_msg_file}")
 
 
 if __name__ == "__main__":
@@ -152,21 +240,19 @@ if __name__ == "__main__":
         print(f"Found {len(chats)} chats.")
 
         # тут значение переменной result сохранить полностью в json в utf-8
+        # (orjson writes datetimes as ISO 8601 itself; other unsupported values such as bytes become null)
         try:
-            def default_converter(o):
-                if isinstance(o, datetime.datetime):
-                    return o.isoformat()
-            with open("result.json", "w", encoding="utf-8") as f:
-                json.dump(result.to_dict(), f, ensure_ascii=False, indent=4, default=default_converter)
+            with open("result.json", "wb") as f:
+                f.write(orjson.dumps(result.to_dict(), default=lambda o: None))
             print("Successfully saved result to result.json")
         except Exception as e:
             print(f"Error saving result to result.json: {e}")
             
-        for chat in chats:
-            if hasattr(chat, 'title'):
-                groups.append(chat)
+        # keep only the monitored channels, so the polling loop does not filter them every cycle
+        groups = [chat for chat in chats if getattr(chat, 'title', None) in monitoring_channels]
 
-        print(f"Monitoring {len(groups)} potential groups/channels.")
-        main()
+        print(f"Monitoring {len(groups)} groups/channels.")
+        # the polling loop runs on the client's event loop, so channel requests can overlap
+        client.loop.run_until_complete(main())
     except Exception as e:
         print(f"Failed to get dialogs: {e}")
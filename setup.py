@@ -0,0 +1,22 @@
+"""
+Сборка необязательного ускоряющего расширения для экспорта.
+
+    python setup.py build_ext --inplace
+
+Без собранного расширения ExportManager использует реализацию на Python.
+"""
+
+from setuptools import setup, Extension
+import Cython
+from Cython.Build import cythonize
+
+if int(Cython.__version__.split('.')[0]) < 3:
+    raise SystemExit(f"Для сборки нужен Cython>=3.0, установлен {Cython.__version__}")
+
+setup(
+    name="telegram-downloader-ext",
+    ext_modules=cythonize(
+        [Extension("_export_fast", ["_export_fast.pyx"])],
+        language_level=3
+    ),
+)
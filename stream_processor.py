@@ -3,8 +3,10 @@
 Оптимизирует использование памяти при скачивании больших чатов.
 """
 
-import json
 import asyncio
+import os
+import sys
+import orjson
 import aiofiles
 from pathlib import Path
 from typing import AsyncGenerator, Dict, Any, Optional, List
@@ -13,9 +15,46 @@ from datetime import datetime
 
 logger = logging.getLogger('telegram_downloader')
 
+class BufferedAsyncWriter:
+    """Буфер поверх файла aiofiles: копит мелкие записи и сбрасывает их крупными блоками."""
+    
+    def __init__(self, file_handle, flush_size: int = 1 << 20):
+        self.file_handle = file_handle
+        self.flush_size = flush_size
+        self._buffer = bytearray()
+    
+    async def write(self, data: bytes) -> None:
+        """Добавляет данные в буфер, записывая его на диск при заполнении."""
+        if not self._buffer and len(data) >= self.flush_size:
+            # Крупный блок пишем сразу, без копирования в буфер
+            await self.file_handle.write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) >= self.flush_size:
+            await self.flush()
+    
+    async def flush(self) -> None:
+        """Записывает накопленные данные одним вызовом."""
+        if self._buffer:
+            # Буфер не меняется до завершения записи, поэтому копия не нужна
+            await self.file_handle.write(self._buffer)
+            self._buffer.clear()
+    
+    async def close(self) -> None:
+        """Сбрасывает остаток буфера."""
+        await self.flush()
+
 class StreamProcessor:
     """Класс для потоковой обработки сообщений Telegram."""
     
+    # Сколько сериализованных пакетов может ждать записи на диск
+    WRITE_QUEUE_SIZE = 64
+    
+    # Обрамление JSON массива в файлах split_large_export
+    _CHUNK_OPEN = b'[\n'
+    _CHUNK_SEPARATOR = b',\n'
+    _CHUNK_CLOSE = b'\n]'
+    
     def __init__(self, chunk_size: int = 1000, max_memory_mb: int = 100):
         self.chunk_size = chunk_size
         self.max_memory_mb = max_memory_mb
@@ -25,7 +64,8 @@ class StreamProcessor:
         self,
         messages_generator: AsyncGenerator[Dict[str, Any], None],
         output_file: Path,
-        batch_size: int = 100
+        batch_size: int = 100,
+        ndjson: bool = False
     ) -> Dict[str, Any]:
         """
         Потоковая обработка сообщений с сохранением в файл.
@@ -34,6 +74,7 @@ class StreamProcessor:
             messages_generator: Асинхронный генератор сообщений
             output_file: Путь к выходному файлу
             batch_size: Размер пакета для записи
+            ndjson: Писать по одному JSON объекту на строку вместо JSON массива
             
         Returns:
             Статистика обработки
@@ -52,34 +93,78 @@ class StreamProcessor:
             output_file.parent.mkdir(parents=True, exist_ok=True)
             
             # Открываем файл для записи
-            async with aiofiles.open(output_file, 'w', encoding='utf-8') as f:
+            async with aiofiles.open(output_file, 'wb') as raw_file:
+                # Каждая запись aiofiles - это переход в пул потоков, поэтому пишем блоками
+                f = BufferedAsyncWriter(raw_file)
+                
                 # Записываем начало JSON массива
-                await f.write('[\n')
+                if not ndjson:
+                    await f.write(b'[\n')
+                encode_batch = self._encode_ndjson_batch if ndjson else self._encode_batch
+                
+                # Пакеты сериализуются в отдельном потоке, а готовые байты по очереди
+                # записывает один писатель: получение сообщений, кодирование и запись
+                # идут одновременно. Ограниченная очередь не дает обогнать диск.
+                write_queue = asyncio.Queue(maxsize=self.WRITE_QUEUE_SIZE)
+                writer_task = asyncio.create_task(self._write_encoded(f, write_queue))
+                encode_tasks = set()
                 
-                first_message = True
-                batch = []
+                async def enqueue(item):
+                    # Ждем места в очереди или завершения писателя: если он упал,
+                    # очередь больше никто не разбирает и put ждал бы вечно
+                    put_task = asyncio.ensure_future(write_queue.put(item))
+                    try:
+                        await asyncio.wait(
+                            {put_task, writer_task}, return_when=asyncio.FIRST_COMPLETED
+                        )
+                    finally:
+                        put_task.cancel()
+                    if not put_task.done() or put_task.cancelled():
+                        # Писатель завершился с ошибкой - поднимаем ее здесь
+                        writer_task.result()
+                        raise RuntimeError("Запись в файл прекращена до конца потока")
                 
-                async for message in messages_generator:
-                    batch.append(message)
-                    stats['total_messages'] += 1
+                async def submit(batch, is_first):
+                    encode_task = asyncio.create_task(
+                        asyncio.to_thread(encode_batch, batch, is_first)
+                    )
+                    encode_tasks.add(encode_task)
+                    encode_task.add_done_callback(encode_tasks.discard)
+                    await enqueue(encode_task)
+                
+                try:
+                    first_message = True
+                    batch = []
                     
-                    # Записываем пакет когда достигли размера
-                    if len(batch) >= batch_size:
-                        await self._write_batch(f, batch, first_message)
-                        stats['chunks_written'] += 1
-                        first_message = False
-                        batch = []
+                    async for message in messages_generator:
+                        batch.append(message)
+                        stats['total_messages'] += 1
                         
-                        # Логируем прогресс
-                        if stats['total_messages'] % 1000 == 0:
-                            self.logger.info(f"Обработано {stats['total_messages']} сообщений")
-                
-                # Записываем оставшиеся сообщения
-                if batch:
-                    await self._write_batch(f, batch, first_message)
+                        # Записываем пакет когда достигли размера
+                        if len(batch) >= batch_size:
+                            await submit(batch, first_message)
+                            stats['chunks_written'] += 1
+                            first_message = False
+                            batch = []
+                            
+                            # Логируем прогресс
+                            if stats['total_messages'] % 1000 == 0:
+                                self.logger.info(f"Обработано {stats['total_messages']} сообщений")
+                    
+                    # Записываем оставшиеся сообщения
+                    if batch:
+                        await submit(batch, first_message)
+                    
+                    await enqueue(None)
+                    await writer_task
+                except BaseException:
+                    await self._stop_writer(writer_task, write_queue, encode_tasks)
+                    raise
                 
                 # Закрываем JSON массив
-                await f.write('\n]')
+                if not ndjson:
+                    await f.write(b'\n]')
+                await f.close()
                 
             # Обновляем статистику
             stats['file_size'] = output_file.stat().st_size
@@ -98,64 +183,125 @@ class StreamProcessor:
             self.logger.error(f"Ошибка в потоковой обработке: {e}")
             raise
     
-    async def _write_batch(
-        self, 
-        file_handle, 
-        batch: List[Dict[str, Any]], 
-        is_first: bool
-    ) -> None:
-        """Записывает пакет сообщений в файл."""
-        for i, message in enumerate(batch):
-            if not is_first or i > 0:
-                await file_handle.write(',\n')
-            
-            # Минифицируем JSON для экономии места
-            json_str = json.dumps(message, ensure_ascii=False, separators=(',', ':'))
-            await file_handle.write('  ' + json_str)
+    async def _write_encoded(self, file_handle, write_queue: asyncio.Queue) -> None:
+        """Записывает сериализованные пакеты из очереди в порядке поступления (None - конец)."""
+        while True:
+            encode_task = await write_queue.get()
+            if encode_task is None:
+                break
+            await file_handle.write(await encode_task)
+    
+    @staticmethod
+    async def _stop_writer(writer_task: asyncio.Task, write_queue: asyncio.Queue, encode_tasks: set) -> None:
+        """
+        Останавливает писателя после ошибки: отменяет несериализованные пакеты
+        и дожидается текущей записи, чтобы файл не закрылся посреди нее.
+        """
+        pending = set(encode_tasks)
+        while not write_queue.empty():
+            queued = write_queue.get_nowait()
+            if queued is not None:
+                pending.add(queued)
+        for task in pending:
+            task.cancel()
+        write_queue.put_nowait(None)
+        await asyncio.gather(writer_task, *pending, return_exceptions=True)
+    
+    def _encode_batch(self, batch: List[Dict[str, Any]], is_first: bool) -> bytes:
+        """Сериализует пакет сообщений в байты для записи в файл."""
+        # Один вызов orjson на весь пакет; внешние скобки массива отбрасываем
+        payload = orjson.dumps(batch, default=str, option=orjson.OPT_NON_STR_KEYS)[1:-1]
+        return payload if is_first else b',' + payload
+    
+    @staticmethod
+    def _encode_ndjson_batch(batch: List[Dict[str, Any]], is_first: bool = False) -> bytes:
+        """Сериализует пакет сообщений в NDJSON: по одному объекту на строку."""
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        return b''.join(orjson.dumps(message, default=str, option=option) for message in batch)
     
     async def create_memory_efficient_generator(
         self,
         messages_iterator,
-        max_memory_items: int = 1000
+        max_memory_items: int = 1000,
+        full_dict: bool = False
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         Создает генератор с ограничением памяти.
         
         Args:
             messages_iterator: Итератор сообщений из Telethon
-            max_memory_items: Максимальное количество сообщений в памяти
+            max_memory_items: Не используется, сохранен для совместимости
+            full_dict: Использовать полный message.to_dict() вместо набора используемых полей
             
         Yields:
             Сообщения по одному
         """
-        buffer = []
+        # Информация об отправителе строится один раз и разделяется между его сообщениями
+        sender_cache = {}
         
         async for message in messages_iterator:
             # Преобразуем сообщение в словарь
-            message_dict = message.to_dict()
+            message_dict = message.to_dict() if full_dict else self.project_message(message)
             
             # Добавляем информацию об отправителе
             sender_info = {}
-            if message.sender:
-                sender = message.sender
-                sender_info["id"] = sender.id
-                sender_info["type"] = type(sender).__name__
-                
-                if hasattr(sender, 'first_name'):
-                    sender_info["first_name"] = sender.first_name
-                    sender_info["last_name"] = sender.last_name
-                    sender_info["username"] = sender.username
-                elif hasattr(sender, 'title'):
-                    sender_info["title"] = sender.title
+            sender = message.sender
+            if sender:
+                key = (type(sender), sender.id)
+                sender_info = sender_cache.get(key)
+                if sender_info is None:
+                    sender_info = sender_cache[key] = self._build_sender_info(sender)
             
             message_dict["sender_info"] = sender_info
             
             yield message_dict
-            
-            # Ограничиваем размер буфера
-            buffer.append(message_dict)
-            if len(buffer) > max_memory_items:
-                buffer.pop(0)
+    
+    @staticmethod
+    def project_message(message) -> Dict[str, Any]:
+        """
+        Преобразует сообщение в словарь только с полями, которые используют
+        фильтры, валидация и экспорт. Вложенные объекты переводятся в словари
+        лишь когда они есть, а от медиа остается только тип - сами файлы
+        описывает media_info.
+        """
+        fwd_from = message.fwd_from
+        reply_to = message.reply_to
+        media = message.media
+        projected = {
+            '_': type(message).__name__,
+            'id': message.id,
+            'date': message.date,
+            'message': message.message or '',
+            'edit_date': message.edit_date,
+            'views': message.views,
+            'forwards': message.forwards,
+            'post_author': message.post_author,
+            'grouped_id': message.grouped_id,
+            'fwd_from': fwd_from.to_dict() if fwd_from else None,
+            'reply_to': reply_to.to_dict() if reply_to else None,
+            'media': {'_': type(media).__name__} if media else None,
+        }
+        action = getattr(message, 'action', None)
+        if action is not None:
+            # Служебное сообщение (закрепление, вход в чат и т.п.): текста у него нет,
+            # как и в to_dict(), зато сохраняется само действие
+            del projected['message']
+            projected['action'] = action.to_dict()
+        return projected
+    
+    @staticmethod
+    def _build_sender_info(sender) -> Dict[str, Any]:
+        """Собирает информацию об отправителе сообщения."""
+        sender_info = {"id": sender.id, "type": type(sender).__name__}
+        
+        if hasattr(sender, 'first_name'):
+            sender_info["first_name"] = sender.first_name
+            sender_info["last_name"] = sender.last_name
+            sender_info["username"] = sender.username
+        elif hasattr(sender, 'title'):
+            sender_info["title"] = sender.title
+        
+        return sender_info
     
     async def split_large_export(
         self,
@@ -179,15 +325,17 @@ class StreamProcessor:
         output_dir.mkdir(parents=True, exist_ok=True)
         
         current_file_num = 1
-        current_file_size = 0
+        # Учитываем обрамление массива '[\n' и '\n]'
+        current_file_size = len(self._CHUNK_OPEN) + len(self._CHUNK_CLOSE)
         current_messages = []
         created_files = []
         
         max_bytes = max_file_size_mb * 1024 * 1024
         
         async for message in messages_generator:
-            message_json = json.dumps(message, ensure_ascii=False)
-            message_size = len(message_json.encode('utf-8'))
+            # Закодированные байты сразу идут в файл - повторной сериализации нет
+            encoded = orjson.dumps(message, default=str, option=orjson.OPT_NON_STR_KEYS)
+            message_size = len(encoded) + (len(self._CHUNK_SEPARATOR) if current_messages else 0)
             
             # Если добавление сообщения превысит лимит, сохраняем текущий файл
             if current_messages and (current_file_size + message_size) > max_bytes:
@@ -197,9 +345,10 @@ class StreamProcessor:
                 
                 current_file_num += 1
                 current_messages = []
-                current_file_size = 0
+                current_file_size = len(self._CHUNK_OPEN) + len(self._CHUNK_CLOSE)
+                message_size = len(encoded)
             
-            current_messages.append(message)
+            current_messages.append(encoded)
             current_file_size += message_size
         
         # Сохраняем последний файл
@@ -210,13 +359,25 @@ class StreamProcessor:
         
         return created_files
     
-    async def _save_chunk(self, messages: List[Dict[str, Any]], file_path: Path) -> None:
-        """Сохраняет чанк сообщений в файл."""
-        async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(messages, ensure_ascii=False, indent=2))
+    async def _save_chunk(self, messages: List[bytes], file_path: Path) -> None:
+        """Сохраняет чанк уже сериализованных сообщений в файл."""
+        # Запись одним вызовом в потоке - без переходов aiofiles на каждую запись
+        await asyncio.to_thread(self._save_chunk_sync, messages, file_path)
         
         self.logger.info(f"Сохранен файл: {file_path} ({len(messages)} сообщений)")
     
+    @classmethod
+    def _save_chunk_sync(cls, messages: List[bytes], file_path: Path) -> None:
+        """Синхронно записывает чанк сообщений как JSON массив."""
+        # Пишем по одному сообщению через буфер файла, не склеивая весь чанк в памяти
+        with open(file_path, 'wb', buffering=1 << 20) as f:
+            f.write(cls._CHUNK_OPEN)
+            for index, message in enumerate(messages):
+                if index:
+                    f.write(cls._CHUNK_SEPARATOR)
+                f.write(message)
+            f.write(cls._CHUNK_CLOSE)
+    
     async def compress_old_exports(self, directory: Path, days_old: int = 7) -> List[Path]:
         """
         Сжимает старые экспортные файлы для экономии места.
@@ -228,30 +389,43 @@ class StreamProcessor:
         Returns:
             Список сжатых файлов
         """
-        import gzip
         import time
         
-        compressed_files = []
         cutoff_time = time.time() - (days_old * 24 * 3600)
         
-        for file_path in directory.glob("*.json"):
-            if file_path.stat().st_mtime < cutoff_time:
-                compressed_path = file_path.with_suffix('.json.gz')
-                
-                # Сжимаем файл
-                async with aiofiles.open(file_path, 'rb') as f_in:
-                    content = await f_in.read()
-                
-                with gzip.open(compressed_path, 'wb') as f_out:
-                    f_out.write(content.encode('utf-8'))
-                
-                # Удаляем оригинал
-                file_path.unlink()
-                
-                compressed_files.append(compressed_path)
-                self.logger.info(f"Сжат файл: {file_path} -> {compressed_path}")
+        # scandir отдает stat из записи каталога без отдельного вызова на каждый файл
+        with os.scandir(directory) as entries:
+            old_files = [
+                directory / entry.name
+                for entry in entries
+                if entry.name.endswith('.json')
+                and entry.is_file()
+                and entry.stat().st_mtime < cutoff_time
+            ]
+        compressed_files = [file_path.with_suffix('.json.gz') for file_path in old_files]
+        
+        # Сжимаем файлы параллельно: zlib отпускает GIL во время сжатия
+        await asyncio.gather(*[
+            asyncio.to_thread(self._compress_file, file_path, compressed_path)
+            for file_path, compressed_path in zip(old_files, compressed_files)
+        ])
+        
+        for file_path, compressed_path in zip(old_files, compressed_files):
+            self.logger.info(f"Сжат файл: {file_path} -> {compressed_path}")
         
         return compressed_files
+    
+    @staticmethod
+    def _compress_file(file_path: Path, compressed_path: Path) -> None:
+        """Синхронно сжимает файл в gzip и удаляет оригинал."""
+        import gzip
+        import shutil
+        
+        # Копируем блоками по 1 MiB, чтобы не держать весь экспорт в памяти
+        with open(file_path, 'rb') as f_in, gzip.open(compressed_path, 'wb', compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, length=1 << 20)
+        
+        file_path.unlink()
 
 class MemoryMonitor:
     """Мониторинг использования памяти."""
@@ -259,15 +433,28 @@ class MemoryMonitor:
     def __init__(self, threshold_mb: int = 500):
         self.threshold_mb = threshold_mb
         self.logger = logging.getLogger('telegram_downloader')
+        
+        # Процесс psutil создается один раз, а не при каждой проверке
+        try:
+            import psutil
+            self._process = psutil.Process()
+        except ImportError:
+            self._process = None
     
     def get_memory_usage(self) -> float:
         """Получает текущее использование памяти в MB."""
+        if self._process is not None:
+            return self._process.memory_info().rss / 1024 / 1024
+        
+        # Без psutil - пиковое RSS процесса (KB в Linux, байты в macOS)
         try:
-            import psutil
-            process = psutil.Process()
-            return process.memory_info().rss / 1024 / 1024
+            import resource
         except ImportError:
             return 0
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return max_rss / 1024 / 1024
+        return max_rss / 1024
     
     async def check_memory_threshold(self) -> bool:
         """Проверяет превышение порога памяти."""
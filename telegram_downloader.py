@@ -7,10 +7,15 @@ import asyncio
 import argparse
 import logging
 import sys
+import time
+import copy
+from collections import deque
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import yaml
 from datetime import datetime
+from telethon.tl.types import User, Chat, Channel
 
 # Импорт модулей
 from auth_info import client
@@ -32,9 +37,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger('telegram_downloader')
 
+# C-реализация libyaml заметно быстрее; без нее используем чистый Python
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+@lru_cache(maxsize=8)
+def _read_config(config_path: str) -> Any:
+    """Читает и разбирает YAML файл конфигурации (кэшируется по пути)."""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=_YAML_LOADER)
+
 class TelegramDownloader:
     """Главный класс для скачивания сообщений из Telegram."""
     
+    # Сколько пакетов может обрабатываться, пока итератор набирает следующий
+    MAX_PENDING_BATCHES = 1
+    
+    # Сколько секунд список чатов берется из кэша без запроса к Telegram
+    DIALOG_CACHE_TTL = 60
+    
     def __init__(self, config_path: str = "config.yaml"):
         self.config = self._load_config(config_path)
         self.resume_manager = ResumeManager()
@@ -46,20 +66,29 @@ class TelegramDownloader:
         
         self.batch_size = self.config.get('batch_size', 1000)
         self.max_concurrent_media = self.config.get('max_concurrent_media', 3)
+        # Полный message.to_dict() вместо набора используемых полей
+        self.full_message_dict = self.config.get('full_message_dict', False)
+        
+        self._dialog_cache = None
+        self._dialog_cache_time = 0.0
     
     def _load_config(self, config_path: str) -> Dict[str, Any]:
         """Загружает конфигурацию из YAML файла."""
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return yaml.safe_load(f)
+            # Копия, чтобы экземпляры не меняли общий закэшированный словарь
+            return copy.deepcopy(_read_config(config_path))
         except FileNotFoundError:
             logger.warning(f"Файл конфигурации {config_path} не найден, использую настройки по умолчанию")
             return {}
     
-    async def list_chats(self) -> List[Dict[str, Any]]:
-        """Получает и выводит список всех чатов."""
-        logger.info("Получение списка чатов...")
-        dialogs = []
+    async def list_chats(self, full: bool = False) -> List[Dict[str, Any]]:
+        """
+        Получает и выводит список всех чатов.
+        
+        По умолчанию для чата сохраняются только id, тип, название и username;
+        full=True возвращает полный entity.to_dict().
+        """
+        dialogs = await self._get_chats(full)
         
         print("\n" + "="*80)
         print("СПИСОК ЧАТОВ")
@@ -67,12 +96,30 @@ class TelegramDownloader:
         print(f"{'ID':<15} {'Тип':<12} {'Название'}")
         print("-"*80)
         
+        # Вывод информации о чатах
+        for chat in dialogs:
+            print(f"{chat['id']:<15} {chat['_type']:<12} {chat['title']}")
+        
+        print("="*80)
+        logger.info(f"Найдено {len(dialogs)} чатов")
+        return dialogs
+    
+    async def _get_chats(self, full: bool = False) -> List[Dict[str, Any]]:
+        """Получает список чатов; краткий список кэшируется на DIALOG_CACHE_TTL секунд."""
+        if (
+            not full
+            and self._dialog_cache is not None
+            and time.monotonic() - self._dialog_cache_time < self.DIALOG_CACHE_TTL
+        ):
+            return self._dialog_cache
+        
+        logger.info("Получение списка чатов...")
+        dialogs = []
+        
         async for dialog in client.iter_dialogs():
             entity = dialog.entity
-            entity_dict = entity.to_dict()
             
             # Определение типа сущности
-            from telethon.tl.types import User, Chat, Channel
             if isinstance(entity, User):
                 entity_type = "User"
                 title = f"{entity.first_name or ''} {entity.last_name or ''}".strip()
@@ -88,21 +135,29 @@ class TelegramDownloader:
                 entity_type = "Unknown"
                 title = f"Chat{entity.id}"
             
-            entity_dict["_type"] = entity_type
-            entity_dict["title"] = title
+            if full:
+                entity_dict = entity.to_dict()
+                entity_dict["_type"] = entity_type
+                entity_dict["title"] = title
+            else:
+                entity_dict = {
+                    "id": entity.id,
+                    "_type": entity_type,
+                    "title": title,
+                    "username": getattr(entity, 'username', None)
+                }
             dialogs.append(entity_dict)
-            
-            # Вывод информации о чате
-            print(f"{entity.id:<15} {entity_type:<12} {title}")
         
-        print("="*80)
-        logger.info(f"Найдено {len(dialogs)} чатов")
+        if not full:
+            self._dialog_cache = dialogs
+            self._dialog_cache_time = time.monotonic()
+        
         return dialogs
     
     async def find_chat_by_name(self, name: str) -> List[Dict[str, Any]]:
         """Ищет чаты по названию (регистронезависимый поиск)."""
         logger.info(f"Поиск чатов по названию: '{name}'")
-        all_chats = await self.list_chats()
+        all_chats = await self._get_chats()
         
         # Регистронезависимый поиск
         name_lower = name.lower()
@@ -116,7 +171,7 @@ class TelegramDownloader:
         if matching_chats:
             print(f"\nНайдено {len(matching_chats)} чат(ов) по запросу '{name}':")
             print("-" * 80)
-            for chat in all_chats:
+            for chat in matching_chats:
                 print(f"ID: {chat['id']} | Тип: {chat['_type']} | Название: {chat['title']}")
         else:
             print(f"\nЧаты с названием содержащим '{name}' не найдены")
@@ -188,6 +243,13 @@ class TelegramDownloader:
         # Подготовка фильтров
         filter_config = filters or self.config.get('filters', {})
         logger.info(f"Фильтры: {self.content_filter.get_filter_summary(filter_config)}")
+        # Фильтры по атрибутам сообщения проверяются до построения словаря,
+        # остальные (типы медиа, отправители) - после
+        message_prefilter = self.content_filter.compile_prefilter(filter_config)
+        message_filter = self.content_filter.compile_filters({
+            name: value for name, value in filter_config.items()
+            if name not in ContentFilter.PREFILTERS
+        })
         
         # Скачивание сообщений
         messages = []
@@ -207,65 +269,93 @@ class TelegramDownloader:
             reverse=True  # От старых к новым
         )
         
-        # Обработка сообщений пакетами
+        # Обработка сообщений пакетами. Пакет обрабатывается (скачиваются медиа)
+        # в отдельной задаче, пока итератор набирает следующий
         batch = []
-        async for message in iterator:
-            if not message:
-                continue
-            
-            # Проверка точки возобновления
-            if resume and resume_point:
-                if message.id <= resume_point:
-                    continue
+        pending_batches = deque()
+        sender_cache = {}
+        # Один семафор на все пакеты: одновременных загрузок медиа
+        # не больше max_concurrent_media, сколько бы пакетов ни обрабатывалось
+        media_semaphore = asyncio.Semaphore(self.max_concurrent_media)
+        
+        async def finish_oldest_batch():
+            nonlocal total_downloaded
+            processed = await pending_batches.popleft()
+            messages.extend(processed)
+            total_downloaded += len(processed)
             
-            # Преобразование сообщения в словарь
-            message_dict = message.to_dict()
+            # Сохранение прогресса
+            if resume:
+                last_message = processed[-1]
+                await self.resume_manager.save_progress(
+                    chat_id,
+                    last_message['id'],
+                    total_downloaded,
+                    {"chat_title": chat_title}
+                )
             
-            # Добавление информации об отправителе
-            sender_info = {}
-            if message.sender:
+            logger.info(f"Обработано {total_downloaded} сообщений")
+        
+        try:
+            async for message in iterator:
+                if not message:
+                    continue
+                
+                # Проверка точки возобновления
+                if resume and resume_point:
+                    if message.id <= resume_point:
+                        continue
+                
+                # Быстрые фильтры по атрибутам - до построения словаря
+                if not message_prefilter(message):
+                    continue
+                
+                # Преобразование сообщения в словарь
+                if self.full_message_dict:
+                    message_dict = message.to_dict()
+                else:
+                    message_dict = self.stream_processor.project_message(message)
+                
+                # Добавление информации об отправителе
+                # (один словарь на отправителя, общий для всех его сообщений)
+                sender_info = {}
                 sender = message.sender
-                sender_info["id"] = sender.id
-                from telethon.tl.types import User, Chat, Channel
-                if isinstance(sender, User):
-                    sender_info["type"] = "User"
-                    sender_info["first_name"] = sender.first_name
-                    sender_info["last_name"] = sender.last_name
-                    sender_info["username"] = sender.username
-                elif isinstance(sender, (Chat, Channel)):
-                    sender_info["type"] = "Channel"
-                    sender_info["title"] = sender.title
-            
-            message_dict["sender_info"] = sender_info
-            
-            # Применение фильтров
-            if not self.content_filter.apply_filters(message_dict, filter_config):
-                continue
-            
-            batch.append(message_dict)
-            
-            # Обработка пакета
-            if len(batch) >= self.batch_size:
-                processed = await self._process_batch(batch, download_media, chat_id)
-                messages.extend(processed)
-                total_downloaded += len(processed)
+                if sender:
+                    key = (type(sender), sender.id)
+                    sender_info = sender_cache.get(key)
+                    if sender_info is None:
+                        sender_info = sender_cache[key] = self._build_sender_info(sender)
                 
-                # Сохранение прогресса
-                if resume:
-                    last_message = batch[-1]
-                    await self.resume_manager.save_progress(
-                        chat_id,
-                        last_message['id'],
-                        total_downloaded,
-                        {"chat_title": chat_title}
-                    )
+                message_dict["sender_info"] = sender_info
+                
+                # Применение фильтров
+                if not message_filter(message_dict):
+                    continue
+                
+                batch.append((message, message_dict))
                 
-                logger.info(f"Обработано {total_downloaded} сообщений")
-                batch = []
+                # Обработка пакета
+                if len(batch) >= self.batch_size:
+                    pending_batches.append(asyncio.create_task(
+                        self._process_batch(batch, download_media, chat_id, media_semaphore)
+                    ))
+                    batch = []
+                    
+                    # Ограничиваем число пакетов, ожидающих в памяти
+                    while len(pending_batches) > self.MAX_PENDING_BATCHES:
+                        await finish_oldest_batch()
+            
+            # Дожидаемся пакетов в порядке их поступления
+            while pending_batches:
+                await finish_oldest_batch()
+        except BaseException:
+            for task in pending_batches:
+                task.cancel()
+            raise
         
         # Обработка оставшихся сообщений
         if batch:
-            processed = await self._process_batch(batch, download_media, chat_id)
+            processed = await self._process_batch(batch, download_media, chat_id, media_semaphore)
             messages.extend(processed)
             total_downloaded += len(processed)
         
@@ -312,56 +402,57 @@ class TelegramDownloader:
             'media_stats': self.media_downloader.get_download_stats() if download_media else None
         }
     
+    @staticmethod
+    def _build_sender_info(sender) -> Dict[str, Any]:
+        """Собирает информацию об отправителе сообщения."""
+        sender_info = {"id": sender.id}
+        if isinstance(sender, User):
+            sender_info["type"] = "User"
+            sender_info["first_name"] = sender.first_name
+            sender_info["last_name"] = sender.last_name
+            sender_info["username"] = sender.username
+        elif isinstance(sender, (Chat, Channel)):
+            sender_info["type"] = "Channel"
+            sender_info["title"] = sender.title
+        return sender_info
+    
     async def _process_batch(
         self,
-        batch: List[Dict[str, Any]],
+        batch: List[Tuple[Any, Dict[str, Any]]],
         download_media: bool,
-        chat_id: int = None
+        chat_id: int = None,
+        media_semaphore: Optional[asyncio.Semaphore] = None
     ) -> List[Dict[str, Any]]:
-        """Обрабатывает пакет сообщений."""
+        """Обрабатывает пакет пар (оригинальное сообщение, словарь сообщения)."""
+        processed_batch = [msg_data for _, msg_data in batch]
+        
         if download_media and chat_id:
             # Скачивание медиафайлов для пакета
             try:
-                # Получаем оригинальные сообщения для скачивания медиа
-                message_ids = [msg['id'] for msg in batch]
-                
-                # Получаем сущность чата
-                entity = await client.get_entity(chat_id)
-                
-                # Получаем оригинальные сообщения
-                original_messages = []
-                for msg_id in message_ids:
-                    try:
-                        msg = await client.get_messages(entity, ids=msg_id)
-                        if msg and msg.media:
-                            original_messages.append(msg)
-                    except Exception as e:
-                        logger.warning(f"Не удалось получить сообщение {msg_id}: {e}")
+                # Оригинальные сообщения уже получены итератором - повторно не запрашиваем
+                original_messages = [msg for msg, _ in batch if msg.media]
                 
                 if original_messages:
                     # Скачиваем медиафайлы
                     media_results = await self.media_downloader.download_batch(
                         original_messages,
                         chat_id,
-                        max_concurrent=self.max_concurrent_media
+                        max_concurrent=self.max_concurrent_media,
+                        semaphore=media_semaphore
                     )
                     
                     # Обновляем сообщения информацией о медиафайлах
                     media_dict = {msg.id: media for msg, media in zip(original_messages, media_results) if media}
                     
-                    processed_batch = []
-                    for msg_data in batch:
+                    for msg_data in processed_batch:
                         msg_id = msg_data['id']
                         if msg_id in media_dict:
                             msg_data['media_info'] = media_dict[msg_id]
-                        processed_batch.append(msg_data)
-                    
-                    return processed_batch
                     
             except Exception as e:
                 logger.error(f"Ошибка при скачивании медиафайлов: {e}")
         
-        return batch
+        return processed_batch
     
     async def interactive_mode(self):
         """Интерактивный режим работы."""
@@ -418,11 +509,14 @@ async def main():
     parser.add_argument("--media", action="store_true", help="Скачивать медиафайлы")
     parser.add_argument("--formats", default="json", help="Форматы экспорта (через запятую)")
     parser.add_argument("--interactive", action="store_true", help="Интерактивный режим")
+    parser.add_argument("--full-dict", action="store_true", help="Сохранять все поля сообщений (message.to_dict())")
     
     args = parser.parse_args()
     
     # Инициализация
     downloader = TelegramDownloader(args.config)
+    if args.full_dict:
+        downloader.full_message_dict = True
     
     try:
         await client.start()
@@ -457,4 +551,10 @@ async def main():
         logger.info("Клиент отключен")
 
 if __name__ == "__main__":
+    # Цикл событий на libuv, если uvloop установлен (не поддерживается в Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Тесты фильтрации сообщений по содержимому.
+"""
+
+from content_filter import ContentFilter, _re2_compatible
+
+def test_text_patterns_backreferences():
+    """Обратные ссылки в паттернах работают и при нескольких паттернах."""
+    content_filter = ContentFilter()
+    patterns = ['(x)\\1', '(a)\\1']
+
+    assert content_filter._filter_by_text_patterns({'message': 'aa'}, patterns)
+    assert content_filter._filter_by_text_patterns({'message': 'xx'}, patterns)
+    assert not content_filter._filter_by_text_patterns({'message': 'ax'}, patterns)
+
+    check = content_filter.compile_filters({'text_patterns': patterns})
+    assert check({'message': 'aa'})
+    assert not check({'message': 'ax'})
+
+def test_text_patterns_without_groups():
+    """Паттерны без групп находятся так же, как при проверке по одному."""
+    content_filter = ContentFilter()
+    patterns = ['hello', 'wor+ld', '^\\d+$']
+
+    for text, expected in [('Hello there', True), ('worrrld', True), ('12345', True), ('123 45', False)]:
+        assert content_filter._filter_by_text_patterns({'message': text}, patterns) == expected
+
+def test_text_patterns_unicode_classes():
+    """\\b, \\w и другие классы совпадают с кириллицей (такие паттерны не отдаются RE2)."""
+    content_filter = ContentFilter()
+
+    assert content_filter._filter_by_text_patterns({'message': 'есть работа тут'}, [r'\bработа\b'])
+    assert not content_filter._filter_by_text_patterns({'message': 'подработаем'}, [r'\bработа\b'])
+    assert content_filter._filter_by_text_patterns({'message': 'новый'}, [r'\w+ый', 'нет'])
+
+    assert not _re2_compatible(r'\bработа\b')
+    assert not _re2_compatible(r'[\d]+')
+    assert _re2_compatible(r'работа|школа')
+    assert _re2_compatible(r'C:\\bin')
+
+SAMPLE_MESSAGES = [
+    {'message': '', 'date': '2024-01-01T10:00:00+00:00', 'sender_info': {}},
+    {'message': 'Привет @user, см. https://example.com', 'date': '2024-02-01T10:00:00+00:00',
+     'sender_info': {'id': 1}, 'photo': {'id': 5}},
+    {'message': 'короткий', 'date': '2024-03-01T10:00:00+00:00', 'sender_info': {'id': 2},
+     'fwd_from': {'from_id': 7}, 'edit_date': '2024-03-02T10:00:00+00:00'},
+    {'message': 'www.site.org и видео', 'date': '2024-04-01T10:00:00+00:00', 'sender_info': {'id': 3},
+     'video': {'id': 9}, 'document': {'id': 9}},
+    {'message': 'почта a@b без ссылок, длинный текст сообщения', 'date': '2024-05-01T10:00:00+00:00',
+     'sender_info': {'id': 1}, 'geo': {'lat': 1.0}},
+]
+
+FILTER_CONFIGS = [
+    {},
+    {'media_types': ['photo']},
+    {'media_types': ['video', 'location']},
+    {'media_types': ['text']},
+    {'media_types': ['unknown']},
+    {'media_types': []},
+    {'text_patterns': ['ссылок', 'видео']},
+    {'text_patterns': ['(к)о\\1?роткий']},
+    {'text_patterns': []},
+    {'date_range': {'start': '2024-02-01T00:00:00+00:00', 'end': '2024-04-15T00:00:00+00:00'}},
+    {'date_range': {'start': '2024-03-01T10:00:00+00:00'}},
+    {'sender_ids': [1, 3]},
+    {'sender_ids': []},
+    {'min_length': 10},
+    {'min_length': 0},
+    {'has_links': True},
+    {'has_links': False},
+    {'has_mentions': True},
+    {'has_mentions': False},
+    {'is_forwarded': True},
+    {'is_forwarded': False},
+    {'is_edited': True},
+    {'is_edited': False},
+    {'is_edited': None},
+    {'media_types': ['photo', 'video'], 'has_links': True, 'sender_ids': [1, 3]},
+    {'text_patterns': ['текст'], 'min_length': 20, 'has_mentions': True, 'is_forwarded': False},
+    {'date_range': {'end': '2024-03-15T00:00:00+00:00'}, 'is_edited': True, 'is_forwarded': True},
+    {'media_types': ['unknown'], 'min_length': 1},
+    {'min_length': 5, 'sender_ids': [2], 'has_links': False, 'has_mentions': False,
+     'date_range': {'start': '2024-01-15T00:00:00+00:00'}},
+]
+
+def test_compile_filters_matches_apply_filters():
+    """Скомпилированный предикат дает те же результаты, что и apply_filters."""
+    content_filter = ContentFilter()
+
+    for raw_config in FILTER_CONFIGS:
+        filters_config = content_filter.create_filter_config(**raw_config)
+        check = content_filter.compile_filters(filters_config)
+        for message in SAMPLE_MESSAGES:
+            expected = content_filter.apply_filters(message, filters_config)
+            assert check(message) == expected, (raw_config, message)
+
+def test_compile_filters_ignores_unknown_filters():
+    """Неизвестные фильтры пропускаются, как и в apply_filters."""
+    content_filter = ContentFilter()
+    check = content_filter.compile_filters({'unknown_filter': True, 'min_length': 3})
+
+    assert check({'message': 'abcd'})
+    assert not check({'message': 'ab'})
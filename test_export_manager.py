@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Тесты экспорта сообщений в табличные форматы.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+
+import openpyxl
+
+from export_manager import ExportManager
+
+def test_excel_direct_writer_roundtrip(tmp_path):
+    """Большая выгрузка, записанная напрямую как XML, читается openpyxl без потерь."""
+    export_manager = ExportManager(str(tmp_path))
+    row_count = ExportManager.EXCEL_DIRECT_THRESHOLD + 1
+
+    data = [
+        {
+            'id': index,
+            'date': datetime(2024, 1, 1, 12, 30, 15, tzinfo=timezone.utc),
+            'message': f'Сообщение №{index} 😀 <b>&amp;</b>',
+            'views': None,
+            'rating': index / 4,
+            'pinned': index % 2 == 0,
+            'sender_info': {'id': 7, 'first_name': 'Тест'},
+        }
+        for index in range(1, row_count + 1)
+    ]
+    data[0]['message'] = 'управляющие\x00\x01\x0b символы\tи\nпереносы'
+    data[1]['sender_info'] = {'id': 8, 'username': 'ünïcödé_日本'}
+
+    output_path = asyncio.run(export_manager.export_excel(data, 'big'))
+
+    workbook = openpyxl.load_workbook(output_path, read_only=True)
+    rows = list(workbook.active.iter_rows(values_only=True))
+    workbook.close()
+
+    header = rows[0]
+    assert header == (
+        'id', 'date', 'message', 'views', 'rating', 'pinned',
+        'sender_info_id', 'sender_info_first_name', 'sender_info_username'
+    )
+    assert len(rows) == row_count + 1
+
+    first = dict(zip(header, rows[1]))
+    assert first['id'] == 1
+    assert first['date'] == datetime(2024, 1, 1, 12, 30, 15)
+    assert first['message'] == 'управляющие символы\tи\nпереносы'
+    assert first['views'] is None
+    assert first['rating'] == 0.25
+    assert first['pinned'] is False
+    assert first['sender_info_first_name'] == 'Тест'
+    assert first['sender_info_username'] is None
+
+    second = dict(zip(header, rows[2]))
+    assert second['sender_info_username'] == 'ünïcödé_日本'
+    assert second['sender_info_first_name'] is None
+    assert second['pinned'] is True
+
+    last = dict(zip(header, rows[-1]))
+    assert last['id'] == row_count
+    assert last['message'] == f'Сообщение №{row_count} 😀 <b>&amp;</b>'
@@ -1,4 +1,4 @@
-import json
+import orjson
 import os
 import datetime
 import re
@@ -11,38 +11,94 @@ from auth_info import client
 # Импорты из Telethon, которые нам понадобятся
 from telethon.tl.types import User, Chat, Channel
 
+# Тип сущности по ее классу: один поиск в словаре вместо цепочки isinstance
+_TYPE_MAP = {User: "User", Chat: "Chat", Channel: "Channel"}
+
 # --- ИМЯ ФАЙЛА ДЛЯ КЭША ---
 DIALOGS_CACHE_FILE = "dialogs_cache.json"
 
+# Сколько сообщений накапливается перед записью в файл
+MESSAGES_WRITE_BATCH = 500
+# Сколько полученных сообщений может ждать обработки
+MESSAGES_QUEUE_SIZE = 1000
+
+# Кэш диалогов в памяти и mtime файла, которому он соответствует:
+# повторные вызовы в том же процессе не перечитывают неизменившийся файл
+_cached_dialogs = None
+_cached_dialogs_mtime = None
+_cached_hashes = None
+
 
 def json_converter(o):
-    if isinstance(o, datetime.datetime):
-        return o.isoformat()
+    # datetime orjson сериализует сам
     if isinstance(o, bytes):
         return repr(o)
 
 
+def dialog_digest(entity_dict):
+    """
+    Отпечаток диалога для сравнения с кэшем. Считается по JSON-представлению,
+    поэтому свежая запись (с datetime) и прочитанная из файла совпадают.
+    """
+    return hash(
+        orjson.dumps(
+            entity_dict,
+            default=json_converter,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+        )
+    )
+
+
 # --- ФУНКЦИЯ ДЛЯ РАБОТЫ С КЭШЕМ ---
 async def update_and_get_dialogs():
     """
     Загружает диалоги из локального кэша, запрашивает свежие данные из Telegram,
     обновляет кэш и сохраняет его на диск. Возвращает полный, актуальный список диалогов.
     """
+    global _cached_dialogs, _cached_dialogs_mtime, _cached_hashes
     cached_dialogs = {}
+    cached_hashes = {}
+
+    try:
+        cache_mtime = os.stat(DIALOGS_CACHE_FILE).st_mtime_ns
+    except OSError:
+        cache_mtime = None
 
     # 1. Загрузка из локального файла, если он существует
-    if os.path.exists(DIALOGS_CACHE_FILE):
+    if cache_mtime is not None and cache_mtime == _cached_dialogs_mtime:
+        # Файл не менялся с прошлого чтения или записи - берем данные из памяти
+        cached_dialogs = _cached_dialogs
+        cached_hashes = _cached_hashes
+        print(
+            f"Загружено {len(cached_dialogs)} диалогов из кэша ({DIALOGS_CACHE_FILE})."
+        )
+    elif cache_mtime is not None:
         try:
-            with open(DIALOGS_CACHE_FILE, "r", encoding="utf-8") as f:
-                cached_dialogs_list = json.load(f)
+            with open(DIALOGS_CACHE_FILE, "rb") as f:
+                cached_dialogs_list = orjson.loads(f.read())
                 # Преобразуем список в словарь для быстрого доступа по ID
                 cached_dialogs = {item["id"]: item for item in cached_dialogs_list}
+            # Отпечатки записей кэша считаются один раз при загрузке
+            cached_hashes = {
+                dialog_id: dialog_digest(item)
+                for dialog_id, item in cached_dialogs.items()
+            }
+            _cached_dialogs = cached_dialogs
+            _cached_dialogs_mtime = cache_mtime
+            _cached_hashes = cached_hashes
             print(
                 f"Загружено {len(cached_dialogs)} диалогов из кэша ({DIALOGS_CACHE_FILE})."
             )
-        except (json.JSONDecodeError, TypeError):
+        except (orjson.JSONDecodeError, TypeError):
             print(f"Не удалось прочитать файл кэша, будет создан новый.")
             cached_dialogs = {}
+            cached_hashes = {}
+
+    # Изменения вносим в копии: кэш в памяти должен соответствовать файлу.
+    # Если запись не удастся, mtime не изменится, и иначе следующий вызов
+    # счел бы изменения уже сохраненными
+    cached_dialogs = dict(cached_dialogs)
+    cached_hashes = dict(cached_hashes)
 
     # 2. Запрос свежих данных из Telegram
     print("Запрос свежих данных о диалогах из Telegram...")
@@ -54,23 +110,23 @@ async def update_and_get_dialogs():
         entity_dict = entity.to_dict()  # Конвертируем сущность в словарь
 
         # Добавляем тип сущности для удобства
-        if isinstance(entity, User):
-            entity_dict["_type"] = "User"
-        elif isinstance(entity, Chat):
-            entity_dict["_type"] = "Chat"
-        elif isinstance(entity, Channel):
-            entity_dict["_type"] = "Channel"
-
-        # 3. Сравнение и обновление
+        entity_type = _TYPE_MAP.get(type(entity))
+        if entity_type is not None:
+            entity_dict["_type"] = entity_type
+
+        # 3. Сравнение и обновление (по отпечаткам, а не глубоким сравнением словарей)
+        digest = dialog_digest(entity_dict)
         if entity.id not in cached_dialogs:
             # Это новый диалог, добавляем его
             cached_dialogs[entity.id] = entity_dict
+            cached_hashes[entity.id] = digest
             new_dialogs_count += 1
         else:
             # Диалог уже есть, просто обновляем его данные
             # Это полезно, если изменилось название чата или фото
-            if cached_dialogs[entity.id] != entity_dict:
+            if cached_hashes.get(entity.id) != digest:
                 cached_dialogs[entity.id] = entity_dict
+                cached_hashes[entity.id] = digest
                 updated_dialogs_count += 1
 
     if new_dialogs_count > 0 or updated_dialogs_count > 0:
@@ -79,16 +135,21 @@ async def update_and_get_dialogs():
         )
         # 4. Сохранение обновленного списка в файл
         try:
-            # Конвертируем словарь обратно в список для сохранения
-            all_dialogs_list = list(cached_dialogs.values())
-            with open(DIALOGS_CACHE_FILE, "w", encoding="utf-8") as f:
-                json.dump(
-                    all_dialogs_list,
-                    f,
-                    ensure_ascii=False,
-                    indent=4,
-                    default=json_converter,
+            # Пишем во временный файл и атомарно подменяем кэш, без отступов:
+            # они многократно увеличивают размер файла и время записи
+            tmp_file = DIALOGS_CACHE_FILE + ".tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(
+                    orjson.dumps(
+                        list(cached_dialogs.values()),
+                        default=json_converter,
+                        option=orjson.OPT_NON_STR_KEYS,
+                    )
                 )
+            os.replace(tmp_file, DIALOGS_CACHE_FILE)
+            _cached_dialogs = cached_dialogs
+            _cached_dialogs_mtime = os.stat(DIALOGS_CACHE_FILE).st_mtime_ns
+            _cached_hashes = cached_hashes
             print(f"Кэш диалогов успешно сохранен в {DIALOGS_CACHE_FILE}.")
         except Exception as e:
             print(f"Ошибка при сохранении кэша: {e}")
@@ -99,6 +160,28 @@ async def update_and_get_dialogs():
     return list(cached_dialogs.values())
 
 
+def _user_title(entity):
+    """Название для пользователя: имя, пометка удаленного аккаунта или ID."""
+    if entity.get("first_name") or entity.get("last_name"):
+        return f"{entity.get('first_name') or ''} {entity.get('last_name') or ''}".strip()
+    if entity.get("deleted"):
+        return f"Удаленный аккаунт (ID: {entity['id']})"
+    return f"Пользователь без имени (ID: {entity['id']})"
+
+
+def _chat_title(entity):
+    """Название для чата или канала."""
+    return entity.get("title")
+
+
+# Отображаемый тип и функция названия для каждого значения '_type'
+_CHAT_FORMATTERS = {
+    "User": ("Пользователь", _user_title),
+    "Chat": ("Канал/Группа", _chat_title),
+    "Channel": ("Канал/Группа", _chat_title),
+}
+
+
 # --- ИЗМЕНЕННАЯ ФУНКЦИЯ ---
 # Теперь она принимает список диалогов как аргумент
 def list_all_chats(dialogs_list):
@@ -114,17 +197,10 @@ def list_all_chats(dialogs_list):
         title = "N/A"
 
         # Определяем тип из поля '_type', которое мы добавили
-        if entity.get("_type") == "User":
-            entity_type = "Пользователь"
-            if entity.get("first_name") or entity.get("last_name"):
-                title = f"{entity.get('first_name') or ''} {entity.get('last_name') or ''}".strip()
-            elif entity.get("deleted"):
-                title = f"Удаленный аккаунт (ID: {entity['id']})"
-            else:
-                title = f"Пользователь без имени (ID: {entity['id']})"
-        elif entity.get("_type") in ["Chat", "Channel"]:
-            entity_type = "Канал/Группа"
-            title = entity.get("title")
+        formatter = _CHAT_FORMATTERS.get(entity.get("_type"))
+        if formatter is not None:
+            entity_type, get_title = formatter
+            title = get_title(entity)
 
         print(f"{entity['id']:<15} | {entity_type:<18} | {title or 'Без названия'}")
 
@@ -132,6 +208,16 @@ def list_all_chats(dialogs_list):
     print(f"Всего диалогов в кэше: {len(dialogs_list)}")
 
 
+def write_messages(f, messages):
+    """Дописывает сообщения в файл NDJSON одним вызовом write."""
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+    f.write(
+        b"".join(
+            orjson.dumps(m, default=json_converter, option=option) for m in messages
+        )
+    )
+
+
 # Замените всю вашу функцию download_chat_history на эту
 async def download_chat_history(chat_identifier, days_limit=None):
     """
@@ -162,9 +248,16 @@ async def download_chat_history(chat_identifier, days_limit=None):
         print(f"Произошла непредвиденная ошибка при поиске чата: {e}")
         return
 
-    all_messages_data = []
     total_messages = 0
 
+    filename_suffix = f"_{days_limit}days" if days_limit else "_full"
+    safe_title = re.sub(
+        r'[\\/*?:"<>|]', "", getattr(entity, "title", f"chat_{entity.id}")
+    )
+    # Сообщения дописываются пакетами, по одному JSON объекту на строку (NDJSON),
+    # поэтому в памяти держится только текущий пакет
+    filename = f"{entity.id}_{safe_title}{filename_suffix}.ndjson"
+
     offset_date_limit = None
     if days_limit is not None and days_limit > 0:
         utc_now = datetime.datetime.now(datetime.timezone.utc)
@@ -172,70 +265,82 @@ async def download_chat_history(chat_identifier, days_limit=None):
         print(
             f"Установлено ограничение: скачиваем сообщения не старше {days_limit} дней (до {offset_date_limit.strftime('%Y-%m-%d %H:%M')})."
         )
-        iterator = client.iter_messages(entity, limit=None)
+        # Сервер сам начинает выдачу с нужной даты: с reverse=True приходят
+        # только сообщения новее offset_date, от старых к новым
+        iterator = client.iter_messages(
+            entity, limit=None, offset_date=offset_date_limit, reverse=True
+        )
     else:
         print("Скачиваю всю историю сообщений. Это может занять много времени...")
         iterator = client.iter_messages(entity, limit=None)
 
-    async for message in iterator:
-        if offset_date_limit and message.date < offset_date_limit:
-            print("Достигнут лимит по дате. Завершение сканирования.")
-            break
-
-        total_messages += 1
-
-        # Преобразуем основное сообщение в словарь
-        message_dict = message.to_dict()
-
-        # Получаем информацию об отправителе
-        sender_info = {}
-        if message.sender:
-            # message.sender - это уже готовый объект User или Channel
-            sender = message.sender
-            sender_info["id"] = sender.id
-            if isinstance(sender, User):
-                sender_info["type"] = "User"
-                sender_info["first_name"] = sender.first_name
-                sender_info["last_name"] = sender.last_name
-                sender_info["username"] = sender.username
-            elif isinstance(sender, (Chat, Channel)):
-                sender_info["type"] = "Channel"
-                sender_info["title"] = sender.title
-
-        # Добавляем новый ключ 'sender_info' в наш словарь сообщения
-        message_dict["sender_info"] = sender_info
-
+    # Получение сообщений из сети и их обработка с записью идут параллельно:
+    # пока обрабатывается очередь, Telethon запрашивает следующую порцию
+    queue = asyncio.Queue(maxsize=MESSAGES_QUEUE_SIZE)
 
-        all_messages_data.append(message_dict)  # Добавляем модифицированный словарь
+    async def produce():
+        try:
+            async for message in iterator:
+                await queue.put(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Даем обработчику завершиться; ошибка поднимется через await producer
+            await queue.put(None)
+            raise
+        await queue.put(None)
 
-        if total_messages % 200 == 0:
-            print(f"Скачано {total_messages} сообщений...")
+    print(f"Сохранение данных в файл: {filename}")
+    producer = asyncio.create_task(produce())
+    try:
+        with open(filename, "wb") as f:
+            buffer = []
+            while (message := await queue.get()) is not None:
+                total_messages += 1
+
+                # Преобразуем основное сообщение в словарь
+                message_dict = message.to_dict()
+
+                # Получаем информацию об отправителе
+                sender_info = {}
+                if message.sender:
+                    # message.sender - это уже готовый объект User или Channel
+                    sender = message.sender
+                    sender_info["id"] = sender.id
+                    if isinstance(sender, User):
+                        sender_info["type"] = "User"
+                        sender_info["first_name"] = sender.first_name
+                        sender_info["last_name"] = sender.last_name
+                        sender_info["username"] = sender.username
+                    elif isinstance(sender, (Chat, Channel)):
+                        sender_info["type"] = "Channel"
+                        sender_info["title"] = sender.title
+
+                # Добавляем новый ключ 'sender_info' в наш словарь сообщения
+                message_dict["sender_info"] = sender_info
+
+
+                buffer.append(message_dict)  # Добавляем модифицированный словарь
+                if len(buffer) >= MESSAGES_WRITE_BATCH:
+                    write_messages(f, buffer)
+                    buffer.clear()
+
+                if total_messages % 200 == 0:
+                    print(f"Скачано {total_messages} сообщений...")
+
+            write_messages(f, buffer)
+    finally:
+        producer.cancel()
+    await producer
 
     print(f"Скачивание завершено. Всего скачано сообщений: {total_messages}.")
 
-    if not all_messages_data:
+    if not total_messages:
+        os.remove(filename)
         print("В чате нет сообщений для сохранения за указанный период.")
         return
 
-    filename_suffix = f"_{days_limit}days" if days_limit else "_full"
-    safe_title = re.sub(
-        r'[\\/*?:"<>|]', "", getattr(entity, "title", f"chat_{entity.id}")
-    )
-    filename = f"{entity.id}_{safe_title}{filename_suffix}.json"
-
-    print(f"Сохранение данных в файл: {filename}")
-    try:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(
-                all_messages_data,
-                f,
-                ensure_ascii=False,
-                indent=4,
-                default=json_converter,
-            )
-        print("Файл успешно сохранен!")
-    except Exception as e:
-        print(f"Ошибка при сохранении файла: {e}")
+    print("Файл успешно сохранен!")
 
 
 async def main():
@@ -299,7 +299,10 @@ class TelegramDownloader:
             getattr(entity, "title", f"chat_{entity.id}")
         )
         
-        output_file = output_dir / f"{entity.id}_{safe_title}{filename_suffix}.json"
+        # NDJSON (по объекту на строку) доступен только при потоковой записи
+        ndjson = use_streaming and output_config.get('ndjson', False)
+        extension = "ndjson" if ndjson else "json"
+        output_file = output_dir / f"{entity.id}_{safe_title}{filename_suffix}.{extension}"
         
         # Получаем количество сообщений
         try:
@@ -339,7 +342,8 @@ class TelegramDownloader:
                     stats = await self.stream_processor.process_messages_stream(
                         messages_gen,
                         output_file,
-                        batch_size=100
+                        batch_size=100,
+                        ndjson=ndjson
                     )
                     
                     console.print(Panel(